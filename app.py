@@ -1,62 +1,825 @@
 from telethon import TelegramClient, events, errors
 import aiohttp
+from aiohttp import web
 import asyncio
 import time
 import logging
+import logging.handlers
+import atexit
+import copy
+import queue
 import json
+import math
 import os
 import yaml
 import re
+import sqlite3
+import sys
+import threading
+import uuid
+from collections import OrderedDict, deque, namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
 from urllib3.util.retry import Retry
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("gmgn_bot.log", encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
-)
+# 安装了orjson时用它解析API响应
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# 列式导出为可选依赖
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    import pyarrow as pa
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON，extra中的字段一并输出"""
+
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        data = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self.RESERVED:
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # 经过日志队列的记录，异常堆栈已在入队时格式化
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """写入日志队列的handler
+
+    默认的 prepare 会把异常堆栈拼进消息正文并清空 exc_info，JSON日志就没有 exc 字段。
+    这里把堆栈格式化到 exc_text，消息正文保持原样，由各输出handler的formatter决定如何输出。
+    """
+
+    exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.exc_formatter.formatException(record.exc_info)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """热点日志限流
+
+    带 sample_key 的记录，同一个key在interval秒内只输出一条，被省略的条数
+    附在下一条输出的记录上。不带 sample_key 的记录和ERROR及以上级别从不丢弃。
+    """
+
+    def __init__(self, interval=0):
+        super().__init__()
+        self.interval = interval
+        self.last = {}
+        self.suppressed = {}
+
+    def filter(self, record):
+        key = getattr(record, "sample_key", None)
+        if key is None or self.interval <= 0 or record.levelno >= logging.ERROR:
+            return True
+        last = self.last.get(key)
+        if last is not None and record.created - last < self.interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            LOG_SUPPRESSED.inc()
+            return False
+        if len(self.last) > 10000:
+            self.last.clear()
+        self.last[key] = record.created
+        skipped = self.suppressed.pop(key, 0)
+        if skipped:
+            record.suppressed = skipped
+            record.msg = f"{record.msg}（已省略 {skipped} 条）"
+        return True
+
+
+class LogManager:
+    """日志管理
+
+    业务代码只把日志记录放入队列，格式化和写文件由后台线程完成，
+    不阻塞事件循环。日志文件按大小轮转。
+    """
+
+    sampler = SamplingFilter()
+    listeners = []
+    root_handler = None
+
+    @classmethod
+    def queue_handler(cls, handlers):
+        """返回一个写入队列的handler，由后台线程交给handlers处理"""
+        log_queue = queue.SimpleQueue()
+        handler = LogQueueHandler(log_queue)
+        handler.addFilter(cls.sampler)
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
+        )
+        listener.start()
+        handler.listener = listener
+        cls.listeners.append(listener)
+        return handler
+
+    @classmethod
+    def setup(
+        cls,
+        log_file="gmgn_bot.log",
+        log_format="text",
+        log_level="INFO",
+        max_bytes=10 * 1024 * 1024,
+        backup_count=5,
+        sample_interval=60,
+    ):
+        """配置根日志，可重复调用"""
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        if log_format == "json":
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        cls.sampler.interval = sample_interval
+
+        root = logging.getLogger()
+        root.setLevel(log_level)
+        if cls.root_handler is not None:
+            root.removeHandler(cls.root_handler)
+            cls.root_handler.listener.stop()
+            cls.listeners.remove(cls.root_handler.listener)
+        cls.root_handler = cls.queue_handler([file_handler, console_handler])
+        root.addHandler(cls.root_handler)
+
+    @classmethod
+    def shutdown(cls):
+        """写完队列中剩余的日志"""
+        for listener in cls.listeners:
+            listener.stop()
+        cls.listeners = []
+
+    @staticmethod
+    def shorten(text, limit=200):
+        """截断过长的消息，并合并为一行"""
+        text = " ".join(str(text).split())
+        if len(text) <= limit:
+            return text
+        return f"{text[:limit]}...（共 {len(text)} 字）"
+
+
+LogManager.setup()
+atexit.register(LogManager.shutdown)
 logger = logging.getLogger("GMGN_Bot")
 
+# 外部API地址，可在配置中覆盖（例如指向本地模拟服务）
+DEXSCREENER_API_URL = "https://api.dexscreener.com"
+BSCSCAN_API_URL = "https://api.bscscan.com/api"
+GECKOTERMINAL_API_URL = "https://api.geckoterminal.com/api/v2"
+BSC_RPC_URL = "https://bsc-dataseed.binance.org/"
+
+
+class Metric:
+    """指标基类，按标签值分别计数"""
+
+    type_name = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (
+            '{}="{}"'.format(
+                name,
+                str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+            )
+            for name, value in pairs
+        )
+        return "{" + ",".join(escaped) + "}"
 
-class ConfigManager:
-    """配置管理类"""
+    def samples(self):
+        for key, value in self.values.items():
+            yield f"{self.name}{self._format_labels(key)} {value}"
 
-    @staticmethod
-    def load_config():
-        """从配置文件加载配置"""
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """可任意设置的瞬时值，也可以在采集时通过回调计算"""
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            self.values[()] = self.function()
+        return super().samples()
+
+
+class Histogram(Metric):
+    """累积分桶直方图"""
+
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = state[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        state[1] += value
+        state[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self._format_labels(key, ('le', bound))} {cumulative}"
+            yield f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {count}"
+            yield f"{self.name}_sum{self._format_labels(key)} {total}"
+            yield f"{self.name}_count{self._format_labels(key)} {count}"
+
+
+class MetricsRegistry:
+    """指标注册表，以Prometheus文本格式输出"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+metrics = MetricsRegistry()
+PROVIDER_LATENCY = metrics.histogram(
+    "gmgn_provider_request_seconds", "外部API请求耗时", ["provider"]
+)
+PROVIDER_ERRORS = metrics.counter(
+    "gmgn_provider_errors_total", "外部API请求错误次数", ["provider", "kind"]
+)
+PROVIDER_RATE_LIMITED = metrics.counter(
+    "gmgn_provider_ratelimited_total", "外部API限流次数", ["provider"]
+)
+MONITOR_TICK = metrics.histogram(
+    "gmgn_monitor_tick_seconds", "单轮价格检查耗时",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+POSITIONS = metrics.gauge("gmgn_positions", "监控中的持仓数量")
+POSITIONS_EVICTED = metrics.counter(
+    "gmgn_positions_evicted_total", "被淘汰停止监控的持仓数", ["reason"]
+)
+PENDING_TRANSACTIONS = metrics.gauge("gmgn_pending_transactions", "待确认交易数量")
+PENDING_OLDEST_AGE = metrics.gauge(
+    "gmgn_pending_transaction_oldest_age_seconds", "最早的待确认交易已等待的秒数"
+)
+TELEGRAM_EVENTS_DROPPED = metrics.counter(
+    "gmgn_telegram_events_dropped_total", "在预过滤阶段丢弃的Telegram消息数", ["stage"]
+)
+TELEGRAM_EVENTS_ACCEPTED = metrics.counter(
+    "gmgn_telegram_events_accepted_total", "进入处理逻辑的Telegram消息数", ["handler"]
+)
+SIGNAL_ADDRESSES = metrics.counter(
+    "gmgn_signal_addresses_total", "信号源中提取到的合约地址数，按处理结果", ["source", "outcome"]
+)
+TELEGRAM_SEND = metrics.histogram(
+    "gmgn_telegram_send_seconds", "Telegram消息发送耗时", ["kind"]
+)
+STARTUP_SECONDS = metrics.gauge(
+    "gmgn_startup_seconds", "启动各阶段耗时", ["stage"]
+)
+PRICE_HEDGED = metrics.counter(
+    "gmgn_price_hedged_total", "主价格源超时后发起的对冲请求次数", ["provider"]
+)
+PRICE_WINNER = metrics.counter(
+    "gmgn_price_source_total", "最终采用的价格来源", ["provider"]
+)
+PROVIDER_HEALTH = metrics.gauge(
+    "gmgn_provider_health_score", "价格源健康评分（越高越好）", ["provider"]
+)
+PROVIDER_CIRCUIT = metrics.gauge(
+    "gmgn_provider_circuit_state", "价格源熔断状态（0关闭 1半开 2打开）", ["provider"]
+)
+LOG_SUPPRESSED = metrics.counter("gmgn_log_suppressed_total", "被限流省略的热点日志条数")
+TIMERS_PENDING = metrics.gauge("gmgn_timers_pending", "时间轮中等待执行的定时任务数")
+OUTBOX_COMMANDS = metrics.gauge("gmgn_outbox_commands", "等待Telegram重连后补发的交易指令数")
+BUY_QUEUE_WAIT = metrics.histogram(
+    "gmgn_buy_queue_wait_seconds", "买入请求排队等待的时间", ["user"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+BUY_QUEUE_DEPTH = metrics.gauge("gmgn_buy_queue_depth", "排队等待的买入请求数", ["user"])
+BUY_QUEUE_REJECTED = metrics.counter(
+    "gmgn_buy_queue_rejected_total", "排队已满被拒绝的买入请求数", ["user"]
+)
+LOOP_LAG = metrics.histogram(
+    "gmgn_event_loop_lag_seconds", "事件循环延迟",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class HttpClient:
+    """外部API请求，统一记录耗时、错误与限流指标
+
+    所有请求共用一个带连接池和DNS缓存的会话，避免每次请求重新建立TLS连接。
+    """
+
+    _session = None
+    _loop = None
+
+    @classmethod
+    def get_session(cls):
+        """返回当前事件循环上的共享会话"""
+        loop = asyncio.get_running_loop()
+        if cls._session is None or cls._session.closed or cls._loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=100, ttl_dns_cache=300, keepalive_timeout=60
+            )
+            cls._session = aiohttp.ClientSession(connector=connector)
+            cls._loop = loop
+        return cls._session
+
+    @classmethod
+    async def warm_up(cls, urls):
+        """并发预热DNS和连接池"""
+        session = cls.get_session()
+
+        async def touch(url):
+            started = time.perf_counter()
+            try:
+                async with session.head(url, timeout=10):
+                    pass
+                logger.info(f"已预热连接 {url}，耗时 {time.perf_counter() - started:.3f}s")
+            except Exception as e:
+                logger.warning(f"预热连接 {url} 失败: {e}")
+
+        await asyncio.gather(*(touch(url) for url in urls))
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+        cls._session = None
+
+    @classmethod
+    async def get_json(cls, provider, url, timeout=10, decode=json_loads):
+        """GET请求并解析JSON，decode 可替换为只提取所需字段的解码函数"""
+        return await cls.request_json(provider, "GET", url, timeout=timeout, decode=decode)
+
+    @classmethod
+    async def post_json(cls, provider, url, payload, timeout=10):
+        """POST JSON请求并解析JSON"""
+        return await cls.request_json(provider, "POST", url, timeout=timeout, json=payload)
+
+    @classmethod
+    async def request_json(cls, provider, method, url, timeout=10, decode=json_loads, **kwargs):
+        started = time.perf_counter()
+        status = None
         try:
-            if os.path.exists("config.yaml"):
-                with open("config.yaml", "r", encoding="utf-8") as f:
-                    config = yaml.safe_load(f)
-                logger.info("已从config.yaml加载配置")
+            session = cls.get_session()
+            async with session.request(method, url, timeout=timeout, **kwargs) as response:
+                status = response.status
+                if status == 429:
+                    PROVIDER_RATE_LIMITED.inc(provider=provider)
+                elif status >= 400:
+                    PROVIDER_ERRORS.inc(provider=provider, kind="http")
+                data = decode(await response.read())
+        except asyncio.TimeoutError:
+            PROVIDER_ERRORS.inc(provider=provider, kind="timeout")
+            raise
+        except asyncio.CancelledError:
+            # 对冲请求被取消不算错误
+            raise
+        except Exception:
+            # 已按HTTP状态计数的不再重复计数
+            if status is None or status < 400:
+                PROVIDER_ERRORS.inc(provider=provider, kind="error")
+            raise
+        finally:
+            PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider)
+
+        # BSCScan限流时仍返回200，只在result中说明
+        if isinstance(data, dict) and "rate limit" in str(data.get("result", "")).lower():
+            PROVIDER_RATE_LIMITED.inc(provider=provider)
+        return data
 
-                # 确保必要的配置项存在
-                if "wallet_address" not in config:
-                    logger.warning("配置中缺少wallet_address参数，将无法验证代币余额")
-                    config["wallet_address"] = ""
 
-                # 确保交易重试配置项存在
-                if "max_transaction_retries" not in config:
-                    config["max_transaction_retries"] = 3  # 默认最多重试3次
-                if "retry_delay" not in config:
-                    config["retry_delay"] = 5  # 默认重试间隔5秒
+class MetricsServer:
+    """本地HTTP指标服务，供Prometheus抓取，可同时挂载状态查询接口"""
 
-                # 确保交易检查配置项存在
-                if "check_balance_only_after_transaction" not in config:
-                    config["check_balance_only_after_transaction"] = True
+    def __init__(self, host, port, status_api=None):
+        self.host = host
+        self.port = port
+        self.status_api = status_api
+        self.runner = None
 
-                # 确保价格检查间隔存在
-                if "price_check_interval" not in config:
-                    config["price_check_interval"] = 30  # 默认30秒检查一次
+    async def handle_metrics(self, request):
+        return web.Response(
+            body=metrics.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
 
-                # 确保买入确认延迟存在
-                if "buy_confirmation_delay" not in config:
-                    config["buy_confirmation_delay"] = 5  # 默认5秒
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        if self.status_api:
+            self.status_api.add_routes(app.router)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+            logger.info(f"指标服务已启动: http://{self.host}:{self.port}/metrics")
+        except OSError as e:
+            logger.warning(f"指标服务启动失败: {e}")
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class VersionedDict(dict):
+    """每次修改都推进版本号的字典，供状态接口生成变更令牌
+
+    dict类型的值写入时转换为VersionedDict，嵌套修改同样推进外层版本号。
+    """
+
+    def __init__(self, *args, on_change=None, **kwargs):
+        super().__init__()
+        self.version = 0
+        self.on_change = on_change
+        self.update(*args, **kwargs)
+
+    def _changed(self):
+        self.version += 1
+        if self.on_change:
+            self.on_change()
+
+    def _wrap(self, value):
+        if type(value) is dict:
+            return VersionedDict(value, on_change=self._changed)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._wrap(value))
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().pop(key)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        if self:
+            super().clear()
+            self._changed()
+
+
+class StatusApi:
+    """本地状态查询接口，挂载在指标服务上
+
+    直接从内存中的持仓、待确认交易、最新价格和价格源统计生成JSON快照。
+    ETag由各数据的版本号组成，版本未变时复用已序列化的响应，
+    请求带 If-None-Match 且数据未变时返回304，轮询几乎不占用交易循环。
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        # 重启后版本号从0开始，ETag带上启动时刻避免与旧令牌冲突
+        self.boot = f"{int(time.time()):x}"
+        self.cache = {}
+        monitor = bot.price_monitor
+        self.sections = {
+            "positions": (
+                lambda: (bot.price_map.version, monitor.last_prices.version),
+                self.positions,
+            ),
+            "pending": (lambda: (bot.pending_transactions.version,), self.pending),
+            "prices": (lambda: (monitor.last_prices.version,), lambda: monitor.last_prices),
+            "providers": (lambda: (monitor.version,), self.providers),
+        }
+
+    def add_routes(self, router):
+        router.add_get("/status", self.handle)
+        router.add_get("/status/{section}", self.handle)
+
+    def positions(self):
+        """持仓列表，附带最新价格和浮动盈亏"""
+        last_prices = self.bot.price_monitor.last_prices
+        result = []
+        for ca, data in self.bot.price_map.items():
+            item = dict(data, ca=ca)
+            last = last_prices.get(ca)
+            if last:
+                item["last_price"] = last["price"]
+                if data.get("buy_price"):
+                    item["gain_percent"] = round(
+                        (last["price"] - data["buy_price"]) / data["buy_price"] * 100, 4
+                    )
+            result.append(item)
+        return result
+
+    def pending(self):
+        return [dict(tx, tx_id=tx_id) for tx_id, tx in self.bot.pending_transactions.items()]
+
+    def providers(self):
+        result = {}
+        for provider in self.bot.price_monitor.providers:
+            result[provider.name] = {
+                "health": round(provider.health(), 4),
+                "success_rate": round(provider.success_rate, 4),
+                "p95": provider.p95(None),
+                "requests": provider.requests,
+                "circuit_state": provider.breaker.state,
+                "consecutive_failures": provider.breaker.failures,
+            }
+        return result
+
+    def render(self, name):
+        """返回 (etag, body)，版本未变时使用缓存"""
+        if name == "all":
+            versions = [v for _, (version, _) in sorted(self.sections.items()) for v in version()]
+        else:
+            versions = list(self.sections[name][0]())
+        etag = '"' + "-".join([self.boot, name] + [str(v) for v in versions]) + '"'
+        cached = self.cache.get(name)
+        if cached and cached[0] == etag:
+            return cached
+        if name == "all":
+            data = {key: build() for key, (_, build) in self.sections.items()}
+        else:
+            data = self.sections[name][1]()
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        self.cache[name] = (etag, body)
+        return etag, body
+
+    async def handle(self, request):
+        name = request.match_info.get("section", "all")
+        if name != "all" and name not in self.sections:
+            raise web.HTTPNotFound()
+        etag, body = self.render(name)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+class Span:
+    """一个计时阶段，退出时导出"""
+
+    def __init__(self, tracer, trace_id, name, attrs):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.attrs = attrs
+        self.start = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and exc_type is not asyncio.CancelledError:
+            self.attrs["error"] = repr(exc)
+        self.tracer.emit(
+            self.trace_id, self.name, self.start, self.tracer.clock() - self.start, self.attrs
+        )
+        return False
+
+
+class Tracer:
+    """交易生命周期追踪
+
+    每个合约地址从收到到最终卖出对应一个trace_id，各阶段以span记录，
+    以JSON Lines格式写入trace文件。
+    """
+
+    def __init__(self, path="traces.jsonl", clock=time.time):
+        self.clock = clock
+        self.active = {}
+        self.enabled = bool(path)
+        self.logger = logging.getLogger("GMGN_Trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if self.enabled and not self.logger.handlers:
+            handler = logging.FileHandler(path, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(LogManager.queue_handler([handler]))
+
+    def start_trace(self, ca, user_id=None):
+        """为合约地址开启新的trace"""
+        trace_id = uuid.uuid4().hex[:16]
+        now = self.clock()
+        self.active[ca] = {"trace_id": trace_id, "started": now, "marks": {}}
+        self.emit(trace_id, "trace_start", now, 0.0, {"ca": ca, "user_id": user_id})
+        return trace_id
+
+    def trace_id(self, ca):
+        trace = self.active.get(ca)
+        return trace["trace_id"] if trace else None
+
+    def span(self, trace_id, name, **attrs):
+        return Span(self, trace_id, name, attrs)
+
+    def event(self, ca, name, **attrs):
+        """记录一个瞬时事件"""
+        trace_id = self.trace_id(ca)
+        if trace_id:
+            self.emit(trace_id, name, self.clock(), 0.0, attrs)
+
+    def mark(self, ca, key):
+        """记录某个时刻，供后续event_since计算间隔"""
+        trace = self.active.get(ca)
+        if trace:
+            trace["marks"][key] = self.clock()
+
+    def event_since(self, ca, name, key, **attrs):
+        """记录从mark时刻到现在的span"""
+        trace = self.active.get(ca)
+        if not trace or key not in trace["marks"]:
+            return
+        start = trace["marks"].pop(key)
+        self.emit(trace["trace_id"], name, start, self.clock() - start, attrs)
+
+    def end_trace(self, ca, outcome):
+        """结束trace，记录总耗时"""
+        trace = self.active.pop(ca, None)
+        if trace:
+            now = self.clock()
+            self.emit(
+                trace["trace_id"], "trace_end", trace["started"], now - trace["started"],
+                {"ca": ca, "outcome": outcome},
+            )
+
+    def emit(self, trace_id, name, start, duration, attrs):
+        if not self.enabled or not trace_id:
+            return
+        record = {"trace_id": trace_id, "span": name, "start": start, "duration": duration}
+        record.update(attrs)
+        self.logger.info(json.dumps(record, ensure_ascii=False))
+
+
+class SamplingProfiler:
+    """采样分析器
+
+    在后台线程定期抓取目标线程（事件循环线程）的调用栈，
+    输出折叠栈格式，可直接用于 flamegraph.pl 或 speedscope。
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+
+    def run(self, seconds):
+        """阻塞采样指定秒数，返回 {折叠栈: 次数}"""
+        counts = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(self.interval)
+        return counts
+
+    @staticmethod
+    def write_collapsed(counts, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+
+class ConfigManager:
+    """配置管理类"""
 
-                return config
+    CONFIG_PATH = "config.yaml"
+    # 启动时才读取的配置项，热重载时保留原值，需要重启才能生效
+    RESTART_KEYS = frozenset({
+        "api_id", "api_hash", "phone", "bot_username", "bot_chat_id",
+        "signal_sources", "signal_dedup_ttl", "signal_dedup_max_size",
+        "price_providers", "price_breaker_failures", "price_breaker_reset",
+        "metrics_host", "metrics_port", "status_api", "trace_file", "trade_db",
+        "state_file", "log_file", "log_format", "log_level", "log_max_bytes",
+        "log_backup_count", "log_sample_interval", "config_reload_interval",
+    })
+
+    @staticmethod
+    def load_config(path=CONFIG_PATH):
+        """从配置文件加载配置"""
+        try:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    config = yaml.safe_load(f)
+                logger.info(f"已从{path}加载配置")
+                return ConfigManager.apply_defaults(config)
             else:
                 logger.error("配置文件不存在，请创建config.yaml文件")
                 raise FileNotFoundError("配置文件不存在")
@@ -64,6 +827,237 @@ class ConfigManager:
             logger.error(f"配置加载失败: {e}")
             raise
 
+    @staticmethod
+    def apply_defaults(config):
+        """补全缺省配置项"""
+        # 确保必要的配置项存在
+        if "wallet_address" not in config:
+            logger.warning("配置中缺少wallet_address参数，将无法验证代币余额")
+            config["wallet_address"] = ""
+
+        # 确保交易重试配置项存在
+        if "max_transaction_retries" not in config:
+            config["max_transaction_retries"] = 3  # 默认最多重试3次
+        if "retry_delay" not in config:
+            config["retry_delay"] = 5  # 默认重试间隔5秒
+
+        # 确保交易检查配置项存在
+        if "check_balance_only_after_transaction" not in config:
+            config["check_balance_only_after_transaction"] = True
+
+        # 确保价格检查间隔存在
+        if "price_check_interval" not in config:
+            config["price_check_interval"] = 30  # 默认30秒检查一次
+
+        # 确保买入确认延迟存在
+        if "buy_confirmation_delay" not in config:
+            config["buy_confirmation_delay"] = 5  # 默认5秒
+
+        # 确保API地址存在
+        if "dexscreener_api_url" not in config:
+            config["dexscreener_api_url"] = DEXSCREENER_API_URL
+        if "bscscan_api_url" not in config:
+            config["bscscan_api_url"] = BSCSCAN_API_URL
+        if "geckoterminal_api_url" not in config:
+            config["geckoterminal_api_url"] = GECKOTERMINAL_API_URL
+        if "bsc_rpc_url" not in config:
+            config["bsc_rpc_url"] = BSC_RPC_URL
+
+        # 确保价格源配置存在
+        if "price_providers" not in config:
+            config["price_providers"] = ["dexscreener", "onchain", "geckoterminal"]
+        if "price_timeout" not in config:
+            config["price_timeout"] = 5  # 单次取价总耗时上限（秒）
+        if "price_hedge_min_delay" not in config:
+            config["price_hedge_min_delay"] = 0.2  # 发起对冲请求前至少等待的秒数
+        if "price_breaker_failures" not in config:
+            config["price_breaker_failures"] = 5  # 连续失败多少次后熔断
+        if "price_breaker_reset" not in config:
+            config["price_breaker_reset"] = 30  # 熔断后多少秒再试探
+
+        # 确保指标服务配置存在，端口为0时不启动
+        if "metrics_host" not in config:
+            config["metrics_host"] = "127.0.0.1"
+        if "metrics_port" not in config:
+            config["metrics_port"] = 9108
+        if "status_api" not in config:
+            config["status_api"] = True  # 在指标服务上提供 /status 状态查询接口
+
+        # 确保追踪与性能分析配置存在
+        if "trace_file" not in config:
+            config["trace_file"] = "traces.jsonl"  # 为空时不记录
+        if "profile_dir" not in config:
+            config["profile_dir"] = "profiles"
+        if "profile_max_seconds" not in config:
+            config["profile_max_seconds"] = 300
+
+        # 确保持仓生命周期配置存在，均为0时不限
+        if "max_position_age" not in config:
+            config["max_position_age"] = 7 * 86400  # 持仓最长监控7天
+        if "max_price_failures" not in config:
+            config["max_price_failures"] = 60  # 连续60轮取不到价格后停止监控
+        if "max_positions" not in config:
+            config["max_positions"] = 100  # 同时监控的持仓上限，达到后不再买入
+        if "max_pending_transactions" not in config:
+            config["max_pending_transactions"] = 500  # 待确认交易上限，超出时丢弃最早的
+
+        # 确保买入调度配置存在，0为不限
+        if "buy_concurrency" not in config:
+            config["buy_concurrency"] = 8  # 同时验证合约和发送买入指令的上限，指令发出后即释放
+        if "user_buy_concurrency" not in config:
+            config["user_buy_concurrency"] = 2  # 每个用户同时验证合约和发送买入指令的上限
+        if "user_buys_per_minute" not in config:
+            config["user_buys_per_minute"] = 0  # 每个用户每分钟最多开始的买入数
+        if "user_buy_queue_size" not in config:
+            config["user_buy_queue_size"] = 20  # 每个用户排队等待的买入上限，超出时拒绝
+        if "user_weights" not in config:
+            config["user_weights"] = {}  # 用户ID到权重，缺省为1，权重越大分到的买入机会越多
+
+        # 确保重连补处理配置存在
+        if "catch_up_limit" not in config:
+            config["catch_up_limit"] = 200  # 重连后最多补处理的交易机器人消息数
+
+        # 确保交易记录库配置存在，为空时不记录
+        if "trade_db" not in config:
+            config["trade_db"] = "trades.db"
+
+        # 确保运行状态文件配置存在（缓存交易机器人实体和持仓）
+        if "state_file" not in config:
+            config["state_file"] = "bot_state.json"
+
+        # 确保信号源配置存在
+        if "signal_sources" not in config:
+            config["signal_sources"] = []
+        if "signal_dedup_ttl" not in config:
+            config["signal_dedup_ttl"] = 3600  # 同一合约地址在此秒数内只处理一次
+        if "signal_dedup_max_size" not in config:
+            config["signal_dedup_max_size"] = 10000
+
+        # 确保日志配置存在
+        if "log_file" not in config:
+            config["log_file"] = "gmgn_bot.log"
+        if "log_format" not in config:
+            config["log_format"] = "text"  # text 或 json
+        if "log_level" not in config:
+            config["log_level"] = "INFO"
+        if "log_max_bytes" not in config:
+            config["log_max_bytes"] = 10 * 1024 * 1024  # 单个日志文件10MB后轮转
+        if "log_backup_count" not in config:
+            config["log_backup_count"] = 5
+        if "log_sample_interval" not in config:
+            config["log_sample_interval"] = 60  # 每个合约的涨幅日志每60秒最多一条，0为不限
+
+        # 确保配置热重载间隔存在
+        if "config_reload_interval" not in config:
+            config["config_reload_interval"] = 5  # 每5秒检查一次配置文件是否修改，0为关闭
+
+        return config
+
+    @staticmethod
+    def validate(config):
+        """校验配置，不合法时抛出ValueError"""
+        if not isinstance(config, Mapping):
+            raise ValueError("配置必须是键值映射")
+        for key in ("bot_username", "buy_amount", "target_gain_percent", "stop_loss_percent"):
+            if config.get(key) in (None, ""):
+                raise ValueError(f"缺少配置项 {key}")
+        try:
+            buy_amount = float(config["buy_amount"])
+        except (TypeError, ValueError):
+            raise ValueError(f"buy_amount 不是有效数字: {config['buy_amount']}")
+        if buy_amount <= 0:
+            raise ValueError("buy_amount 必须大于0")
+        for key in (
+            "target_gain_percent", "stop_loss_percent", "price_check_interval",
+            "buy_confirmation_delay", "retry_delay", "max_transaction_retries",
+        ):
+            value = config.get(key)
+            if value is not None and (
+                isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0
+            ):
+                raise ValueError(f"{key} 必须是非负数: {value}")
+        if config.get("price_check_interval") == 0:
+            raise ValueError("price_check_interval 必须大于0")
+        users = config.get("authorized_users")
+        if users is not None and (
+            not isinstance(users, (list, tuple))
+            or not all(isinstance(user, int) and not isinstance(user, bool) for user in users)
+        ):
+            raise ValueError(f"authorized_users 必须是用户ID列表: {users}")
+        weights = config.get("user_weights")
+        if weights is not None and (
+            not isinstance(weights, Mapping)
+            or not all(
+                isinstance(weight, (int, float)) and not isinstance(weight, bool) and weight > 0
+                for weight in weights.values()
+            )
+        ):
+            raise ValueError(f"user_weights 必须是用户ID到正数权重的映射: {weights}")
+
+
+class ConfigSnapshot(Mapping):
+    """编译后的只读配置快照
+
+    读取方式与配置字典相同，嵌套的字典和列表也被冻结。热路径常用的派生值
+    （交易机器人会话、授权用户集合、BSCScan密钥是否可用）在编译时算好。
+    配置变化时整体替换为新快照，不在原对象上修改。
+    """
+
+    def __init__(self, config):
+        ConfigManager.validate(config)
+        self._data = self._freeze(config)
+        self.bot_chat_id = self._data.get("bot_chat_id") or None
+        # 交易指令的发送目标：优先使用会话ID
+        self.bot_target = self.bot_chat_id or self._data["bot_username"]
+        self.bot_entities = frozenset(
+            entity for entity in (self.bot_chat_id, self._data["bot_username"]) if entity
+        )
+        self.authorized_users = frozenset(self._data.get("authorized_users") or ())
+        api_key = self._data.get("bscscan_api_key")
+        self.has_bscscan_key = bool(api_key) and api_key != "YOUR_BSCSCAN_API_KEY"
+
+    @classmethod
+    def _freeze(cls, value):
+        if isinstance(value, Mapping):
+            return MappingProxyType({key: cls._freeze(item) for key, item in value.items()})
+        if isinstance(value, (list, tuple)):
+            return tuple(cls._freeze(item) for item in value)
+        return value
+
+    @classmethod
+    def _thaw(cls, value):
+        if isinstance(value, Mapping):
+            return {key: cls._thaw(item) for key, item in value.items()}
+        if isinstance(value, tuple):
+            return [cls._thaw(item) for item in value]
+        return value
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def to_dict(self):
+        """可修改的普通字典副本"""
+        return self._thaw(self._data)
+
+    def replace(self, **changes):
+        """返回应用了修改的新快照"""
+        config = self.to_dict()
+        config.update(changes)
+        return ConfigSnapshot(config)
+
+    def changed_keys(self, other):
+        """与另一份快照相比取值不同的配置项"""
+        return {
+            key for key in set(self._data) | set(other)
+            if self._data.get(key) != other.get(key)
+        }
+
 
 class ContractValidator:
     """合约验证类"""
@@ -75,40 +1069,30 @@ class ContractValidator:
         """异步验证合约地址是否存在"""
         try:
             # 首先尝试使用BSCScan API直接验证合约是否存在
-            if (
-                "bscscan_api_key" in self.config
-                and self.config["bscscan_api_key"]
-                and self.config["bscscan_api_key"] != "YOUR_BSCSCAN_API_KEY"
-            ):
-                bsc_url = f"https://api.bscscan.com/api?module=contract&action=getabi&address={ca}&apikey={self.config['bscscan_api_key']}"
+            if self.config.has_bscscan_key:
+                bsc_url = f"{self.config['bscscan_api_url']}?module=contract&action=getabi&address={ca}&apikey={self.config['bscscan_api_key']}"
 
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(bsc_url, timeout=10) as response:
-                        bsc_data = await response.json()
+                bsc_data = await HttpClient.get_json("bscscan", bsc_url)
 
-                        # 检查合约是否存在
-                        if (
-                            bsc_data["status"] == "1"
-                            or bsc_data["result"] == "Contract source code not verified"
-                        ):
-                            logger.info(f"BSCScan API 验证合约 {ca} 存在")
-                            return True, "合约地址有效"
+                # 检查合约是否存在
+                if (
+                    bsc_data["status"] == "1"
+                    or bsc_data["result"] == "Contract source code not verified"
+                ):
+                    logger.info(f"BSCScan API 验证合约 {ca} 存在")
+                    return True, "合约地址有效"
 
             # 方法2: 使用DexScreener API验证是否有交易对
-            url = f"https://api.dexscreener.com/latest/dex/tokens/{ca}"
+            url = f"{self.config['dexscreener_api_url']}/latest/dex/tokens/{ca}"
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as response:
-                    data = await response.json()
-                    if "pairs" in data and data["pairs"] and len(data["pairs"]) > 0:
-                        return True, "合约地址有效"
+            pairs = await HttpClient.get_json(
+                "dexscreener", url, decode=DexScreenerProvider.decode_pairs
+            )
+            if pairs:
+                return True, "合约地址有效"
 
             # 如果BSCScan API未配置或验证失败，且DexScreener也没有数据，再尝试BSCScan合约代码检查
-            if (
-                "bscscan_api_key" not in self.config
-                or self.config["bscscan_api_key"] == "YOUR_BSCSCAN_API_KEY"
-                or not self.config["bscscan_api_key"]
-            ):
+            if not self.config.has_bscscan_key:
                 # 使用BSCScan API检查合约代码
                 logger.warning(f"BSCScan API密钥未配置或无效，无法完全验证合约 {ca}")
                 return (
@@ -123,24 +1107,368 @@ class ContractValidator:
             return False, f"验证合约地址时出错: {e}"
 
 
-class PriceMonitor:
-    """价格监控类"""
+class CircuitBreaker:
+    """熔断器：连续失败达到阈值后打开，冷却后放行一次试探请求"""
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.state = self.CLOSED
+        self.probing = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            PROVIDER_CIRCUIT.set(state, provider=self.name)
+
+    def allow(self):
+        """是否允许发起请求"""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != self.CLOSED:
+            logger.info(f"价格源 {self.name} 已恢复")
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"价格源 {self.name} 连续失败 {self.failures} 次，熔断 {self.reset_timeout} 秒")
+            self.opened_at = self.clock()
+            self._set_state(self.OPEN)
+
+    def release(self):
+        """试探请求被取消时归还名额"""
+        self.probing = False
+
+
+class PriceProvider:
+    """价格源基类，子类实现fetch，返回美元价格或None，出错时抛出异常"""
+
+    name = "base"
 
-    @staticmethod
-    async def get_price_dexscreener(ca):
-        """从DexScreener获取当前价格"""
-        url = f"https://api.dexscreener.com/latest/dex/tokens/{ca}"
+    def __init__(self, config):
+        self.config = config
+        self.breaker = CircuitBreaker(
+            self.name,
+            config["price_breaker_failures"],
+            config["price_breaker_reset"],
+        )
+        self.latencies = deque(maxlen=100)
+        self.success_rate = 1.0
+        self.requests = 0
+
+    async def fetch(self, ca):
+        raise NotImplementedError
+
+    def p95(self, default):
+        """最近请求耗时的p95，样本不足时返回default"""
+        if len(self.latencies) < 10:
+            return default
+        ordered = sorted(self.latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def health(self):
+        """健康评分：成功率越高、延迟越低分数越高"""
+        return self.success_rate / (1 + self.p95(1.0))
+
+    def _record(self, ok, elapsed):
+        self.requests += 1
+        self.latencies.append(elapsed)
+        self.success_rate = self.success_rate * 0.9 + (0.1 if ok else 0.0)
+        PROVIDER_HEALTH.set(round(self.health(), 4), provider=self.name)
+
+    async def get(self, ca):
+        """带熔断和健康统计的取价，失败返回None
+
+        没有该代币数据不算价格源故障，只有请求出错才计入熔断。
+        """
+        started = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, timeout=10) as response:
-                    data = await response.json()
-                    if "pairs" in data and data["pairs"] and len(data["pairs"]) > 0:
-                        return float(data["pairs"][0]["priceUsd"])
-            logger.warning(f"获取价格数据格式不正确: {data}")
-            return None
+            price = await self.fetch(ca)
+            ok = True
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
         except Exception as e:
-            logger.error(f"DexScreener获取价格失败: {e}")
+            logger.warning(f"价格源 {self.name} 获取 {ca} 价格失败: {e}")
+            price = None
+            ok = False
+        if ok:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        self._record(ok, time.perf_counter() - started)
+        return price
+
+
+DexPair = namedtuple("DexPair", ["pair_address", "chain_id", "price_usd", "liquidity_usd"])
+
+
+class DexScreenerProvider(PriceProvider):
+    """DexScreener交易对价格"""
+
+    name = "dexscreener"
+
+    @staticmethod
+    def decode_pairs(body, chain_id="bsc"):
+        """解析 /latest/dex/tokens 响应，只保留指定链上交易对的价格、地址和流动性
+
+        完整的交易对数据（成交、交易量、代币信息等）解析后立即丢弃，
+        返回的 DexPair 按流动性从高到低排序。
+        """
+        data = json_loads(body)
+        pairs = []
+        for pair in (data.get("pairs") if isinstance(data, dict) else None) or ():
+            if pair.get("chainId") != chain_id:
+                continue
+            try:
+                price = float(pair["priceUsd"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            liquidity = (pair.get("liquidity") or {}).get("usd") or 0.0
+            pairs.append(DexPair(pair.get("pairAddress"), chain_id, price, float(liquidity)))
+        pairs.sort(key=lambda pair: -pair.liquidity_usd)
+        return pairs
+
+    async def fetch(self, ca):
+        url = f"{self.config['dexscreener_api_url']}/latest/dex/tokens/{ca}"
+        pairs = await HttpClient.get_json(self.name, url, timeout=10, decode=self.decode_pairs)
+        if pairs:
+            return pairs[0].price_usd
+        return None
+
+
+class GeckoTerminalProvider(PriceProvider):
+    """GeckoTerminal代币价格"""
+
+    name = "geckoterminal"
+
+    async def fetch(self, ca):
+        url = f"{self.config['geckoterminal_api_url']}/simple/networks/bsc/token_price/{ca}"
+        data = await HttpClient.get_json(self.name, url, timeout=10)
+        prices = data.get("data", {}).get("attributes", {}).get("token_prices", {})
+        price = prices.get(ca.lower())
+        return float(price) if price else None
+
+
+class OnChainReservesProvider(PriceProvider):
+    """通过BSC节点读取PancakeSwap V2交易对储备计算价格
+
+    代币价格 = 代币/WBNB储备比 × WBNB/USDT储备比，
+    交易对地址、token0和精度只查询一次；尚无交易对的结果只缓存 PAIR_MISS_TTL 秒，
+    之后新建的交易对仍能查到。
+    """
+
+    name = "onchain"
+    FACTORY = "0xca143ce32fe78f1f7019d7d551a6402fc5350c73"
+    WBNB = "0xbb4cdb9cbd36b01bd1cbaebf2de08d9173bc095c"
+    USDT = "0x55d398326f99059ff775485246999027b3197955"
+    GET_PAIR = "0xe6a43905"
+    GET_RESERVES = "0x0902f1ac"
+    TOKEN0 = "0x0dfe1681"
+    DECIMALS = "0x313ce567"
+    PAIR_MISS_TTL = 60
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.pairs = {}
+        # 没有交易对的查询结果及查询时间
+        self.missing = {}
+        self.request_id = 0
+
+    async def eth_call(self, to, data):
+        self.request_id += 1
+        payload = {
+            "jsonrpc": "2.0",
+            "id": self.request_id,
+            "method": "eth_call",
+            "params": [{"to": to, "data": data}, "latest"],
+        }
+        result = await HttpClient.post_json("bsc_rpc", self.config["bsc_rpc_url"], payload)
+        if "error" in result:
+            raise ValueError(result["error"])
+        return result["result"]
+
+    @staticmethod
+    def has_data(result):
+        """eth_call 对不存在的合约或方法返回空结果 "0x"，属于没有数据而不是出错"""
+        return len(result or "") > 2
+
+    async def pair_info(self, token, quote):
+        """返回 (交易对地址, 代币是否为token0, 代币精度)，无交易对时返回None"""
+        key = (token, quote)
+        if key in self.pairs:
+            return self.pairs[key]
+        checked_at = self.missing.get(key)
+        if checked_at is not None:
+            if time.time() - checked_at < self.PAIR_MISS_TTL:
+                return None
+            del self.missing[key]
+        data = f"{self.GET_PAIR}{token[2:].rjust(64, '0')}{quote[2:].rjust(64, '0')}"
+        pair = await self.eth_call(self.FACTORY, data)
+        info = None
+        if self.has_data(pair) and int(pair, 16) != 0:
+            pair = "0x" + pair[-40:]
+            token0, decimals = await asyncio.gather(
+                self.eth_call(pair, self.TOKEN0), self.eth_call(token, self.DECIMALS)
+            )
+            if self.has_data(token0) and self.has_data(decimals):
+                info = (pair, token0[-40:] == token[2:], int(decimals, 16))
+        if info is None:
+            if len(self.missing) >= 1000:
+                self.missing.clear()
+            self.missing[key] = time.time()
+        else:
+            self.pairs[key] = info
+        return info
+
+    async def quote_price(self, token, quote, quote_decimals=18):
+        """token以quote计价的价格"""
+        info = await self.pair_info(token, quote)
+        if info is None:
             return None
+        pair, token_is_token0, decimals = info
+        reserves = await self.eth_call(pair, self.GET_RESERVES)
+        if not self.has_data(reserves):
+            return None
+        reserve0 = int(reserves[2:66], 16)
+        reserve1 = int(reserves[66:130], 16)
+        token_reserve, quote_reserve = (
+            (reserve0, reserve1) if token_is_token0 else (reserve1, reserve0)
+        )
+        if not token_reserve:
+            return None
+        return (quote_reserve / 10**quote_decimals) / (token_reserve / 10**decimals)
+
+    async def fetch(self, ca):
+        token = ca.lower()
+        token_bnb, bnb_usd = await asyncio.gather(
+            self.quote_price(token, self.WBNB), self.quote_price(self.WBNB, self.USDT)
+        )
+        if token_bnb and bnb_usd:
+            return token_bnb * bnb_usd
+        return None
+
+
+# 可用的价格源，按名称在配置 price_providers 中启用，新价格源在此注册即可
+PRICE_PROVIDERS = {
+    DexScreenerProvider.name: DexScreenerProvider,
+    OnChainReservesProvider.name: OnChainReservesProvider,
+    GeckoTerminalProvider.name: GeckoTerminalProvider,
+}
+
+
+class PriceMonitor:
+    """价格监控类
+
+    按健康评分依次请求各价格源：当前请求在其p95耗时内未返回时
+    对冲请求下一个价格源，采用最先返回的有效价格；熔断中的价格源被跳过，
+    总耗时不超过 price_timeout。
+    """
+
+    # 最新价格最多保留的合约数
+    LAST_PRICES_MAX = 1000
+
+    def __init__(self, config, clock=time.time):
+        self.config = config
+        self.clock = clock
+        # 每个合约最近一次取到的价格，供状态接口查询
+        self.last_prices = VersionedDict()
+        self.providers = []
+        for name in config["price_providers"]:
+            if name not in PRICE_PROVIDERS:
+                logger.warning(f"未知的价格源: {name}")
+                continue
+            self.providers.append(PRICE_PROVIDERS[name](config))
+
+    @property
+    def version(self):
+        """价格源统计的版本号，每次请求后变化"""
+        return sum(provider.requests for provider in self.providers)
+
+    def remember(self, ca, price, provider):
+        """记录最新价格，超出上限时丢弃最早的合约"""
+        self.last_prices.pop(ca, None)
+        self.last_prices[ca] = {"price": price, "provider": provider, "time": self.clock()}
+        if len(self.last_prices) > self.LAST_PRICES_MAX:
+            del self.last_prices[next(iter(self.last_prices))]
+
+    def available(self):
+        """是否还有未熔断的价格源"""
+        return any(provider.breaker.state != CircuitBreaker.OPEN for provider in self.providers)
+
+    def ranked(self):
+        """按健康评分排序，评分相同时保持配置顺序"""
+        return sorted(self.providers, key=lambda provider: -provider.health())
+
+    async def get_price(self, ca):
+        """获取价格，所有价格源都失败时返回None"""
+        candidates = self.ranked()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.config["price_timeout"]
+        running = {}
+        hedge_at = None
+
+        def launch(hedged=False):
+            """请求下一个未熔断的价格源"""
+            nonlocal hedge_at
+            while candidates:
+                provider = candidates.pop(0)
+                if not provider.breaker.allow():
+                    continue
+                if hedged:
+                    PRICE_HEDGED.inc(provider=provider.name)
+                running[asyncio.ensure_future(provider.get(ca))] = provider
+                hedge_delay = max(self.config["price_hedge_min_delay"], provider.p95(1.0))
+                hedge_at = loop.time() + hedge_delay
+                return True
+            return False
+
+        if not launch():
+            logger.warning(f"所有价格源均处于熔断状态，无法获取 {ca} 的价格")
+            return None
+        try:
+            while running:
+                wait_until = min(hedge_at, deadline) if candidates else deadline
+                done, _ = await asyncio.wait(
+                    running, timeout=max(0, wait_until - loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    provider = running.pop(task)
+                    price = task.result()
+                    if price:
+                        PRICE_WINNER.inc(provider=provider.name)
+                        self.remember(ca, price, provider.name)
+                        return price
+                if loop.time() >= deadline:
+                    logger.warning(f"获取 {ca} 价格超时")
+                    break
+                if candidates and (done or loop.time() >= hedge_at):
+                    launch(hedged=not done)
+            return None
+        finally:
+            for task in running:
+                task.cancel()
 
 
 class BlockchainInteraction:
@@ -153,24 +1481,18 @@ class BlockchainInteraction:
         """异步通过交易哈希获取交易详情"""
         try:
             # 确保有BSCScan API密钥
-            if (
-                "bscscan_api_key" not in self.config
-                or not self.config["bscscan_api_key"]
-                or self.config["bscscan_api_key"] == "YOUR_BSCSCAN_API_KEY"
-            ):
+            if not self.config.has_bscscan_key:
                 return False, "BSCScan API密钥未配置，无法查询交易详情"
 
             # 使用BSCScan API查询交易详情
-            api_url = f"https://api.bscscan.com/api?module=proxy&action=eth_getTransactionByHash&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
+            api_url = f"{self.config['bscscan_api_url']}?module=proxy&action=eth_getTransactionByHash&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(api_url, timeout=10) as response:
-                    data = await response.json()
+            data = await HttpClient.get_json("bscscan", api_url)
 
-                    if "result" in data and data["result"]:
-                        return True, data["result"]
-                    else:
-                        return False, f"查询失败: {data.get('message', '未知错误')}"
+            if "result" in data and data["result"]:
+                return True, data["result"]
+            else:
+                return False, f"查询失败: {data.get('message', '未知错误')}"
         except Exception as e:
             logger.error(f"查询交易详情时出错: {e}")
             return False, f"查询出错: {e}"
@@ -195,44 +1517,40 @@ class BlockchainInteraction:
 
         # 如果直接方法失败，尝试获取内部交易
         try:
-            api_url = f"https://api.bscscan.com/api?module=account&action=txlistinternal&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(api_url) as response:
-                    data = await response.json()
-
-                    if (
-                        "result" in data
-                        and isinstance(data["result"], list)
-                        and len(data["result"]) > 0
-                    ):
-                        for tx in data["result"]:
-                            if "contractAddress" in tx and tx["contractAddress"]:
-                                # 验证这是否是一个有效的合约地址
-                                validator = ContractValidator(self.config)
-                                is_valid, _ = await validator.verify_contract(
-                                    tx["contractAddress"]
-                                )
-                                if is_valid:
-                                    return tx["contractAddress"]
+            api_url = f"{self.config['bscscan_api_url']}?module=account&action=txlistinternal&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
+
+            data = await HttpClient.get_json("bscscan", api_url, timeout=None)
+
+            if (
+                "result" in data
+                and isinstance(data["result"], list)
+                and len(data["result"]) > 0
+            ):
+                for tx in data["result"]:
+                    if "contractAddress" in tx and tx["contractAddress"]:
+                        # 验证这是否是一个有效的合约地址
+                        validator = ContractValidator(self.config)
+                        is_valid, _ = await validator.verify_contract(
+                            tx["contractAddress"]
+                        )
+                        if is_valid:
+                            return tx["contractAddress"]
         except Exception as e:
             logger.error(f"获取内部交易时出错: {e}")
 
         # 如果上述方法都失败，尝试获取代币转账事件
         try:
-            api_url = f"https://api.bscscan.com/api?module=account&action=tokentx&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(api_url) as response:
-                    data = await response.json()
-
-                    if (
-                        "result" in data
-                        and isinstance(data["result"], list)
-                        and len(data["result"]) > 0
-                    ):
-                        # 返回第一个代币合约地址
-                        return data["result"][0]["contractAddress"]
+            api_url = f"{self.config['bscscan_api_url']}?module=account&action=tokentx&txhash={tx_hash}&apikey={self.config['bscscan_api_key']}"
+
+            data = await HttpClient.get_json("bscscan", api_url, timeout=None)
+
+            if (
+                "result" in data
+                and isinstance(data["result"], list)
+                and len(data["result"]) > 0
+            ):
+                # 返回第一个代币合约地址
+                return data["result"][0]["contractAddress"]
         except Exception as e:
             logger.error(f"获取代币转账事件时出错: {e}")
 
@@ -245,28 +1563,22 @@ class BlockchainInteraction:
                 return False, "钱包地址或代币地址为空"
 
             # 确保有BSCScan API密钥
-            if (
-                "bscscan_api_key" not in self.config
-                or not self.config["bscscan_api_key"]
-                or self.config["bscscan_api_key"] == "YOUR_BSCSCAN_API_KEY"
-            ):
+            if not self.config.has_bscscan_key:
                 return False, "BSCScan API密钥未配置，无法查询链上余额"
 
             # 使用BSCScan API查询代币余额
-            api_url = f"https://api.bscscan.com/api?module=account&action=tokenbalance&contractaddress={token_address}&address={wallet_address}&tag=latest&apikey={self.config['bscscan_api_key']}"
+            api_url = f"{self.config['bscscan_api_url']}?module=account&action=tokenbalance&contractaddress={token_address}&address={wallet_address}&tag=latest&apikey={self.config['bscscan_api_key']}"
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(api_url, timeout=10) as response:
-                    data = await response.json()
+            data = await HttpClient.get_json("bscscan", api_url)
 
-                    if data["status"] == "1":
-                        balance = int(data["result"])
-                        if balance > 0:
-                            return True, f"余额: {balance}"
-                        else:
-                            return False, "余额为零"
-                    else:
-                        return False, f"查询失败: {data['message']}"
+            if data["status"] == "1":
+                balance = int(data["result"])
+                if balance > 0:
+                    return True, f"余额: {balance}"
+                else:
+                    return False, "余额为零"
+            else:
+                return False, f"查询失败: {data['message']}"
         except Exception as e:
             logger.error(f"查询代币余额时出错: {e}")
             return False, f"查询出错: {e}"
@@ -321,53 +1633,1393 @@ class TransactionManager:
             logger.error(f"从消息中提取交易哈希时出错: {e}")
             return None
 
+
+class TradeStore:
+    """交易记录存储（SQLite）
+
+    买入和卖出通过 position_id 关联。卖出记录冗余保存入场价 entry_price
+    和所卖部分的BNB成本 amount_bnb，统计盈亏时只扫描卖出记录，不需要联表；
+    卖出比例记在 sell_fraction。按时间、合约、用户和持仓建索引。
+
+    交易写入放入队列，由后台线程用独立连接执行并按批提交，不阻塞事件循环。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            position_id TEXT,
+            contract TEXT NOT NULL,
+            action TEXT NOT NULL,
+            price REAL,
+            entry_price REAL,
+            amount_bnb REAL,
+            sell_fraction REAL,
+            user_id INTEGER,
+            reason TEXT
+        );
+        CREATE INDEX IF NOT EXISTS trades_action_ts ON trades (action, ts);
+        CREATE INDEX IF NOT EXISTS trades_position ON trades (position_id);
+        CREATE INDEX IF NOT EXISTS trades_contract ON trades (contract, ts);
+        CREATE INDEX IF NOT EXISTS trades_user ON trades (user_id, ts);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+    COLUMNS = (
+        "ts", "position_id", "contract", "action", "price",
+        "entry_price", "amount_bnb", "sell_fraction", "user_id", "reason",
+    )
+    INSERT = f"INSERT INTO trades ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+    # 盈亏统计的分组方式
+    GROUPS = {
+        "user": "user_id",
+        "token": "contract",
+        "day": "date(ts, 'unixepoch', 'localtime')",
+    }
+    # 后台线程每次提交最多合并的写入数
+    BATCH_SIZE = 100
+
+    def __init__(self, path="trades.db"):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        # 早期的库没有 reason 列
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(trades)")}
+        if "reason" not in columns:
+            self.db.execute("ALTER TABLE trades ADD COLUMN reason TEXT")
+        self.queue = queue.SimpleQueue()
+        self.writer = None
+
+    def _submit(self, method, *args):
+        """把写入交给后台线程，首次写入时启动线程"""
+        if self.writer is None:
+            self.writer = threading.Thread(target=self._write_loop, name="trade-store", daemon=True)
+            self.writer.start()
+        self.queue.put((method, args))
+
+    def _write_loop(self):
+        """后台写入线程：取出队列中已有的写入，在同一个事务中执行后提交"""
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA synchronous=NORMAL")
+        try:
+            while True:
+                batch = [self.queue.get()]
+                while len(batch) < self.BATCH_SIZE:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                for item in batch:
+                    if item is None:
+                        continue
+                    method, args = item
+                    try:
+                        method(db, *args)
+                    except Exception as e:
+                        logger.error(f"保存交易记录失败: {e}")
+                try:
+                    db.commit()
+                except Exception as e:
+                    logger.error(f"提交交易记录失败: {e}")
+                if None in batch:
+                    return
+        finally:
+            db.close()
+
     @staticmethod
-    def save_transaction(ca, action, price, amount=None, user_id=None):
-        """保存交易记录到文件"""
+    def new_position_id():
+        return uuid.uuid4().hex[:16]
+
+    @staticmethod
+    def parse_amount(amount):
+        """"0.01" → (0.01, None)；"100%" → (None, 1.0)；无法解析时两者均为None"""
+        if amount is None:
+            return None, None
+        text = str(amount).strip()
         try:
-            transaction = {
-                "timestamp": time.time(),
-                "contract": ca,
-                "action": action,
-                "price": price,
-                "amount": amount,
-                "user_id": user_id,
-            }
-            with open("transactions.json", "a", encoding="utf-8") as f:
-                f.write(json.dumps(transaction) + "\n")
+            if text.endswith("%"):
+                return None, float(text[:-1]) / 100
+            return float(text), None
+        except ValueError:
+            return None, None
+
+    def _row(self, ts, position_id, ca, action, price, amount, user_id, entry=None, reason=None):
+        """组装一行，卖出时 entry 为所属持仓的 (入场价, 买入BNB)"""
+        amount_bnb, sell_fraction = self.parse_amount(amount)
+        if action == "buy":
+            entry_price = price
+        else:
+            entry_price, bought_bnb = entry or (None, None)
+            if bought_bnb is not None:
+                amount_bnb = bought_bnb * (1.0 if sell_fraction is None else sell_fraction)
+        return (
+            ts, position_id, ca, action, price,
+            entry_price, amount_bnb, sell_fraction, user_id, reason,
+        )
+
+    def record(
+        self, ca, action, price, amount=None, user_id=None, position_id=None, ts=None, reason=None
+    ):
+        """记录一笔交易，卖出未带 position_id 时关联该合约最近一次买入
+
+        action 为 buy / sell，或 evict（持仓被淘汰、停止监控，reason 为淘汰原因）。
+        在后台线程写入。
+        """
+        self._submit(
+            self._record, ca, action, price, amount, user_id, position_id,
+            time.time() if ts is None else ts, reason,
+        )
+
+    def _record(self, db, ca, action, price, amount, user_id, position_id, ts, reason):
+        entry = None
+        if action == "sell":
+            if position_id is None:
+                row = db.execute(
+                    "SELECT position_id, price, amount_bnb FROM trades "
+                    "WHERE contract = ? AND action = 'buy' ORDER BY ts DESC LIMIT 1",
+                    (ca,),
+                ).fetchone()
+            else:
+                row = db.execute(
+                    "SELECT position_id, price, amount_bnb FROM trades "
+                    "WHERE position_id = ? AND action = 'buy'",
+                    (position_id,),
+                ).fetchone()
+            if row:
+                position_id, entry = row[0], row[1:]
+        db.execute(
+            self.INSERT,
+            self._row(ts, position_id, ca, action, price, amount, user_id, entry, reason),
+        )
+
+    def update_price(self, position_id, price):
+        """用成交价修正买入记录和该持仓的入场价，在后台线程写入"""
+        self._submit(self._update_price, position_id, price)
+
+    @staticmethod
+    def _update_price(db, position_id, price):
+        db.execute(
+            "UPDATE trades SET entry_price = ?, "
+            "price = CASE WHEN action = 'buy' THEN ? ELSE price END "
+            "WHERE position_id = ?",
+            (price, price, position_id),
+        )
+
+    def import_legacy(self, path="transactions.json"):
+        """导入旧的 transactions.json，每个文件只导入一次，返回导入条数
+
+        旧记录没有持仓ID：同一合约的买入开启新持仓，之后的卖出归入该持仓，
+        累计卖出100%后持仓关闭。
+        """
+        if not os.path.exists(path):
+            return 0
+        key = f"legacy_import:{os.path.abspath(path)}"
+        if self.db.execute("SELECT 1 FROM meta WHERE key = ?", (key,)).fetchone():
+            return 0
+        rows = []
+        open_positions = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    tx = json.loads(line)
+                    ca = tx["contract"]
+                    action = tx["action"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                position = open_positions.get(ca)
+                if action == "buy" or position is None:
+                    position = {"id": self.new_position_id(), "entry": None, "sold": 0.0}
+                    if action == "buy":
+                        open_positions[ca] = position
+                row = self._row(
+                    tx.get("timestamp") or 0, position["id"], ca, action,
+                    tx.get("price"), tx.get("amount"), tx.get("user_id"), position["entry"],
+                )
+                if action == "buy":
+                    position["entry"] = (row[5], row[6])
+                else:
+                    position["sold"] += 1.0 if row[7] is None else row[7]
+                    if position["sold"] >= 1:
+                        open_positions.pop(ca, None)
+                rows.append(row)
+        with self.db:
+            self.db.executemany(self.INSERT, rows)
+            self.db.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (key, str(len(rows))))
+        logger.info(f"已从 {path} 导入 {len(rows)} 条交易记录")
+        return len(rows)
+
+    def pnl(self, by="token", since=None, until=None):
+        """按用户、合约或日期统计已实现盈亏
+
+        收益率 = 卖出价 / 入场价 - 1，BNB盈亏 = 所卖部分的BNB成本 × 收益率。
+        """
+        where, params = ["action = 'sell'", "entry_price > 0"], []
+        if since is not None:
+            where.append("ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("ts < ?")
+            params.append(until)
+        cursor = self.db.execute(
+            f"""
+            SELECT {self.GROUPS[by]} AS key,
+                   COUNT(*) AS sells,
+                   SUM(price > entry_price) AS wins,
+                   AVG((price / entry_price - 1) * 100) AS avg_gain_percent,
+                   SUM(amount_bnb * (price / entry_price - 1)) AS pnl_bnb
+            FROM trades
+            WHERE {' AND '.join(where)}
+            GROUP BY key
+            ORDER BY pnl_bnb DESC
+            """,
+            params,
+        )
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def rows(self, since=None):
+        """按时间顺序取出交易记录"""
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM trades"
+        params = ()
+        if since is not None:
+            sql += " WHERE ts >= ?"
+            params = (since,)
+        return self.db.execute(sql + " ORDER BY ts", params).fetchall()
+
+    def columns(self, since=None):
+        """按列取出交易记录，安装了numpy时返回数组"""
+        rows = self.rows(since)
+        data = {
+            name: [row[i] for row in rows] for i, name in enumerate(self.COLUMNS)
+        }
+        if np is None:
+            return data
+        for name in ("ts", "price", "entry_price", "amount_bnb", "sell_fraction"):
+            data[name] = np.array(data[name], dtype=np.float64)
+        data["user_id"] = np.array(
+            [0 if value is None else value for value in data["user_id"]], dtype=np.int64
+        )
+        for name in ("position_id", "contract", "action", "reason"):
+            data[name] = np.array(["" if value is None else value for value in data[name]])
+        return data
+
+    def export(self, path, since=None):
+        """按扩展名导出列式文件，返回导出条数：.parquet / .arrow 需要pyarrow，.npz 需要numpy"""
+        if path.endswith((".parquet", ".arrow", ".feather")):
+            if pa is None:
+                raise RuntimeError("导出Parquet/Arrow需要安装pyarrow")
+            rows = self.rows(since)
+            table = pa.table({
+                name: [row[i] for row in rows] for i, name in enumerate(self.COLUMNS)
+            })
+            if path.endswith(".parquet"):
+                pyarrow.parquet.write_table(table, path)
+            else:
+                pyarrow.feather.write_feather(table, path)
+            return len(rows)
+        if path.endswith(".npz"):
+            if np is None:
+                raise RuntimeError("导出npz需要安装numpy")
+            data = self.columns(since)
+            np.savez_compressed(path, **data)
+            return len(data["ts"])
+        raise ValueError(f"不支持的导出格式: {path}")
+
+    def close(self):
+        """等待排队的写入完成后关闭"""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+        self.db.close()
+
+
+class Timer:
+    """时间轮中的一个定时任务"""
+
+    __slots__ = ("wheel", "expires", "callback", "args", "cancelled", "fired")
+
+    def __init__(self, wheel, expires, callback, args):
+        self.wheel = wheel
+        self.expires = expires
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self.fired = False
+
+    def cancel(self):
+        """取消定时任务，已执行或已取消时无效果"""
+        if not self.cancelled and not self.fired:
+            self.cancelled = True
+            self.wheel.count -= 1
+
+
+class TimerWheel:
+    """分层时间轮
+
+    定时任务按到期tick放入对应层级的槽位，添加和取消都是O(1)，
+    由一个后台任务按tick推进，高层槽位到期时下沉到低层。
+    回调可以是普通函数或协程函数，协程在独立任务中运行。
+    """
+
+    def __init__(self, tick=0.1, slots=64, levels=4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = 0
+        self.origin = None
+        self.count = 0
+        self.tasks = set()
+        self.runner = None
+        self.wakeup = None
+        self.loop = None
+        self.closed = False
+
+    def _tick_at(self, when):
+        return int((when - self.origin) / self.tick)
+
+    def _place(self, timer):
+        delta = timer.expires - self.current
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1) or level == self.levels - 1:
+                slot = (timer.expires // self.slots**level) % self.slots
+                self.wheels[level][slot].append(timer)
+                return
+
+    def schedule(self, delay, callback, *args):
+        """delay秒后执行callback(*args)，返回可取消的Timer"""
+        if self.closed:
+            # 关闭后不再接受新的定时任务，也不再启动推进任务
+            timer = Timer(self, 0, callback, args)
+            timer.cancelled = True
+            return timer
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.origin is None:
+            self.origin = now
+        if self.count == 0:
+            # 空闲时直接对齐到当前时间，不必逐tick追赶
+            self.current = max(self.current, self._tick_at(now))
+        expires = max(
+            self.current + 1, math.ceil((now + delay - self.origin) / self.tick)
+        )
+        timer = Timer(self, expires, callback, args)
+        self._place(timer)
+        self.count += 1
+        self._ensure_runner(loop)
+        return timer
+
+    async def sleep(self, delay):
+        """等待delay秒"""
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        if self.closed:
+            raise asyncio.CancelledError()
+        future = asyncio.get_running_loop().create_future()
+        timer = self.schedule(delay, self._wake, future)
+        try:
+            await future
+        finally:
+            timer.cancel()
+
+    @staticmethod
+    def _wake(future):
+        if not future.done():
+            future.set_result(None)
+
+    def _ensure_runner(self, loop):
+        if self.runner is None or self.runner.done() or self.loop is not loop:
+            self.loop = loop
+            self.wakeup = asyncio.Event()
+            self.runner = loop.create_task(self._run())
+        self.wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.count == 0:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            target = self._tick_at(loop.time())
+            while self.current < target and self.count:
+                self._advance()
+            if self.count == 0:
+                continue
+            # 睡到下一个需要处理的tick，新增更早的定时任务时被唤醒；
+            # 浮点误差时至少睡十分之一个tick，避免空转
+            delay = self.origin + self._next_due() * self.tick - loop.time()
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), max(self.tick / 10, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    def _next_due(self):
+        """下一个需要处理的tick：最近的非空0层槽位，或下一次下沉"""
+        boundary = (self.current // self.slots + 1) * self.slots
+        for due in range(self.current + 1, boundary):
+            if self.wheels[0][due % self.slots]:
+                return due
+        return boundary
+
+    def _advance(self):
+        self.current += 1
+        # 从高层到低层依次下沉到期的槽位
+        level = 1
+        while level < self.levels and self.current % self.slots**level == 0:
+            level += 1
+        for cascade in range(level - 1, 0, -1):
+            index = (self.current // self.slots**cascade) % self.slots
+            bucket = self.wheels[cascade][index]
+            self.wheels[cascade][index] = []
+            for timer in bucket:
+                if not timer.cancelled:
+                    self._place(timer)
+
+        index = self.current % self.slots
+        bucket = self.wheels[0][index]
+        self.wheels[0][index] = []
+        for timer in bucket:
+            if timer.cancelled:
+                continue
+            timer.fired = True
+            self.count -= 1
+            self._fire(timer)
+
+    def _fire(self, timer):
+        try:
+            result = timer.callback(*timer.args)
+            if asyncio.iscoroutine(result):
+                task = asyncio.ensure_future(result)
+                self.tasks.add(task)
+                task.add_done_callback(self._task_done)
         except Exception as e:
-            logger.error(f"保存交易记录失败: {e}")
+            logger.error(f"定时任务执行出错: {e}")
+
+    def _task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"定时任务执行出错: {task.exception()}")
+
+    def stop(self):
+        """停止推进并取消进行中的回调任务"""
+        if self.runner is not None:
+            self.runner.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+
+    async def close(self):
+        """停止并等待推进任务和回调任务结束，之后不再接受新的定时任务"""
+        self.closed = True
+        self.stop()
+        pending = list(self.tasks)
+        if self.runner is not None:
+            pending.append(self.runner)
+            self.runner = None
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+class TTLSeenSet:
+    """有上限的限时去重集合，超过ttl或容量时淘汰最早的记录"""
+
+    def __init__(self, ttl, max_size, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.items = OrderedDict()
+
+    def _expire(self, now):
+        while self.items:
+            oldest, seen_at = next(iter(self.items.items()))
+            if now - seen_at < self.ttl:
+                break
+            self.items.popitem(last=False)
+
+    def __contains__(self, key):
+        self._expire(self.clock())
+        return key in self.items
+
+    def add(self, key):
+        """记录key，之前未见过（或已过期）时返回True"""
+        now = self.clock()
+        self._expire(now)
+        if key in self.items:
+            return False
+        self.items[key] = now
+        if len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+        return True
+
+    def __len__(self):
+        return len(self.items)
+
+
+class TokenBucket:
+    """令牌桶，限制每分钟的数量"""
+
+    def __init__(self, per_minute, clock=time.time):
+        self.rate = per_minute / 60
+        self.capacity = max(1, per_minute)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """距离下一个令牌可用的秒数，当前可用时为0"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class BuyScheduler:
+    """买入请求的加权公平调度
+
+    每个用户一个队列，请求入队时按用户权重计算虚拟完成时间（自计时公平排队），
+    有空闲并发时从各用户队首取虚拟完成时间最小的请求执行。同时限制总并发、
+    每个用户的并发和每分钟买入数，超出速率的用户暂时跳过，等到有令牌时再调度。
+    """
+
+    def __init__(self, config, run, clock=time.time, timers=None):
+        self.config = config
+        # run(user_id, ca, source, release) 是执行买入流程的协程函数，
+        # 买入指令发出后调用 release() 提前释放并发名额，确认等待和取价不占名额
+        self.run = run
+        self.clock = clock
+        self.timers = timers
+        self.queues = {}
+        self.finish = {}
+        self.virtual_time = 0.0
+        self.running = 0
+        self.active = {}
+        self.buckets = {}
+        self.tasks = set()
+        self.wakeup = None
+
+    def __len__(self):
+        return sum(len(user_queue) for user_queue in self.queues.values())
+
+    def weight(self, user_id):
+        return self.config["user_weights"].get(user_id, 1)
+
+    def _bucket(self, user_id):
+        """用户的买入速率令牌桶，未限速时返回None，配置变化时重建"""
+        per_minute = self.config["user_buys_per_minute"]
+        if not per_minute:
+            return None
+        bucket = self.buckets.get(user_id)
+        if bucket is None or bucket.capacity != max(1, per_minute):
+            bucket = self.buckets[user_id] = TokenBucket(per_minute, self.clock)
+        return bucket
+
+    def submit(self, user_id, ca, source=None):
+        """登记买入请求并尝试立即调度，该用户排队已满时返回False"""
+        user_queue = self.queues.get(user_id)
+        limit = self.config["user_buy_queue_size"]
+        if limit and user_queue is not None and len(user_queue) >= limit:
+            BUY_QUEUE_REJECTED.inc(user=user_id)
+            return False
+        if user_queue is None:
+            user_queue = self.queues[user_id] = deque()
+        # 连续提交的请求依次排在该用户上一个请求之后，权重越大间隔越小
+        finish = max(self.virtual_time, self.finish.get(user_id, 0.0)) + 1 / self.weight(user_id)
+        self.finish[user_id] = finish
+        user_queue.append((finish, self.clock(), ca, source))
+        BUY_QUEUE_DEPTH.set(len(user_queue), user=user_id)
+        self.dispatch()
+        return True
+
+    def _next_user(self):
+        """选出可以执行的队首请求所属用户，没有时返回 (None, 最近的令牌等待秒数)"""
+        per_user = self.config["user_buy_concurrency"]
+        best = None
+        retry = None
+        for user_id, user_queue in self.queues.items():
+            if per_user and self.active.get(user_id, 0) >= per_user:
+                continue
+            bucket = self._bucket(user_id)
+            if bucket is not None:
+                wait = bucket.wait_time()
+                if wait > 0:
+                    retry = wait if retry is None else min(retry, wait)
+                    continue
+            if best is None or user_queue[0][0] < self.queues[best][0][0]:
+                best = user_id
+        return best, retry
+
+    def dispatch(self):
+        """在并发和速率限制内启动排队的买入"""
+        limit = self.config["buy_concurrency"]
+        while not limit or self.running < limit:
+            user_id, retry = self._next_user()
+            if user_id is None:
+                if retry is not None:
+                    self._schedule_wakeup(retry)
+                return
+            user_queue = self.queues[user_id]
+            finish, enqueued_at, ca, source = user_queue.popleft()
+            BUY_QUEUE_DEPTH.set(len(user_queue), user=user_id)
+            if not user_queue:
+                # 队列取空后该用户的虚拟完成时间不超过当前虚拟时间，不必保留
+                del self.queues[user_id]
+                del self.finish[user_id]
+            self.virtual_time = max(self.virtual_time, finish)
+            bucket = self._bucket(user_id)
+            if bucket is not None:
+                bucket.take()
+            BUY_QUEUE_WAIT.observe(self.clock() - enqueued_at, user=user_id)
+            self.running += 1
+            self.active[user_id] = self.active.get(user_id, 0) + 1
+            release = self._releaser(user_id)
+            task = asyncio.create_task(self.run(user_id, ca, source, release))
+            self.tasks.add(task)
+            task.add_done_callback(lambda task, release=release: self._finished(task, release))
+
+    def _releaser(self, user_id):
+        """返回释放一个买入并发名额的函数，多次调用只释放一次"""
+        released = False
+
+        def release(dispatch=True):
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.running -= 1
+            self.active[user_id] -= 1
+            if not self.active[user_id]:
+                del self.active[user_id]
+            if dispatch and self.queues:
+                self.dispatch()
+
+        return release
+
+    def _finished(self, task, release):
+        self.tasks.discard(task)
+        # 买入流程结束时名额未释放则在此释放；被取消说明正在关闭，不再启动新的买入
+        release(dispatch=not task.cancelled())
+
+    def _schedule_wakeup(self, delay):
+        if self.timers is None:
+            return
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        self.wakeup = self.timers.schedule(delay, self._wake)
+
+    def _wake(self):
+        self.wakeup = None
+        self.dispatch()
+
+
+class SignalIngestor:
+    """信号频道/群组的合约地址提取
+
+    从消息文本、链接实体和按钮链接中提取所有BSC地址，跨信号源限时去重，
+    并按信号源的每分钟额度放行到买入流程。
+    """
+
+    # 前后不能紧接其他十六进制字符，避免把交易哈希截成地址
+    ADDRESS_RE = re.compile(r"(?<![0-9a-zA-Z])0x[0-9a-fA-F]{40}(?![0-9a-fA-F])")
+
+    def __init__(self, config, clock=time.time):
+        self.sources = {}
+        default_user = (config.get("authorized_users") or [None])[0]
+        for source in config["signal_sources"]:
+            if not isinstance(source, Mapping):
+                source = {"chat": source}
+            notify_user = source.get("notify_user", default_user)
+            if notify_user is None:
+                logger.warning(f"信号源 {source['chat']} 没有可通知的用户，已忽略")
+                continue
+            self.sources[source["chat"]] = {
+                "notify_user": notify_user,
+                "bucket": TokenBucket(source.get("max_per_minute", 5), clock),
+            }
+        self.seen = TTLSeenSet(
+            config["signal_dedup_ttl"], config["signal_dedup_max_size"], clock
+        )
+
+    @property
+    def chats(self):
+        return list(self.sources)
+
+    @classmethod
+    def extract(cls, message):
+        """提取消息中的所有地址，保持出现顺序并去重"""
+        parts = [message.message or ""]
+        for entity in getattr(message, "entities", None) or ():
+            url = getattr(entity, "url", None)
+            if url:
+                parts.append(url)
+        markup = getattr(message, "reply_markup", None)
+        for row in getattr(markup, "rows", None) or ():
+            for button in row.buttons:
+                url = getattr(button, "url", None)
+                if url:
+                    parts.append(url)
+        text = "\n".join(parts)
+        if "0x" not in text:
+            return []
+        found = OrderedDict()
+        for address in cls.ADDRESS_RE.findall(text):
+            found.setdefault(address.lower(), address)
+        return list(found.values())
+
+    async def resolve(self, client):
+        """把按用户名或链接配置的信号源解析为带标记的会话ID，与 event.chat_id 一致"""
+        for chat in list(self.sources):
+            if isinstance(chat, int):
+                continue
+            try:
+                peer_id = await client.get_peer_id(chat)
+            except Exception as e:
+                logger.error(f"无法解析信号源 {chat}，已忽略: {e}")
+                del self.sources[chat]
+                continue
+            logger.info(f"信号源 {chat} 的会话ID: {peer_id}")
+            self.sources[peer_id] = self.sources.pop(chat)
+
+    def mark_seen(self, ca):
+        """记录通过其他途径收到的合约地址"""
+        self.seen.add(ca.lower())
+
+    def accept(self, source, addresses, holding=()):
+        """返回需要买入的地址，holding为已持有或处理中的地址（小写）"""
+        config = self.sources.get(source)
+        if config is None:
+            return []
+        accepted = []
+        for ca in addresses:
+            key = ca.lower()
+            if key in holding or key in self.seen:
+                SIGNAL_ADDRESSES.inc(source=source, outcome="duplicate")
+            elif not config["bucket"].take():
+                # 超出额度的地址不记入去重集合，之后再次出现时仍可买入
+                SIGNAL_ADDRESSES.inc(source=source, outcome="over_budget")
+            else:
+                self.seen.add(key)
+                SIGNAL_ADDRESSES.inc(source=source, outcome="accepted")
+                accepted.append(ca)
+        return accepted
 
 
 class BSCBot:
     """BSC交易机器人主类"""
 
-    def __init__(self):
-        self.config = ConfigManager.load_config()
-        self.price_map = {}
-        self.pending_transactions = {}
+    # 交易机器人回复中的美元成交价，例如 "价格: $0.00012" 或 "Price 0.00012 USD"
+    FILL_PRICE_RE = re.compile(
+        r"(?:成交价格?|买入价格?|价格|price)\s*[:：]?\s*"
+        r"(?:\$\s*(\d+(?:\.\d+)?(?:[eE]-?\d+)?)|(\d+(?:\.\d+)?(?:[eE]-?\d+)?)\s*USD)",
+        re.IGNORECASE,
+    )
+    # 待处理交易等待确认的最长秒数
+    PENDING_TTL = 300
+    # 排队指令连续补发失败多少次后放弃，补发重试的最长间隔秒数
+    OUTBOX_MAX_ATTEMPTS = 5
+    OUTBOX_MAX_BACKOFF = 60
+
+    def __init__(self, config=None):
+        # 从配置文件加载时才监视文件变化并热重载
+        self.config_path = ConfigManager.CONFIG_PATH if config is None else None
+        if config is None:
+            config = ConfigManager.load_config(self.config_path)
+        self.config = config if isinstance(config, ConfigSnapshot) else ConfigSnapshot(config)
+        self.config_mtime = None
+        # 带版本号，状态接口据此判断是否变化
+        self.price_map = VersionedDict()
+        self.pending_transactions = VersionedDict()
         self.client = None
+        # 时钟可替换，回放引擎会换成虚拟时钟
+        self.clock = time.time
         self.blockchain = BlockchainInteraction(self.config)
         self.validator = ContractValidator(self.config)
+        self.price_monitor = PriceMonitor(self.config, clock=lambda: self.clock())
+        self.trades = TradeStore(self.config["trade_db"]) if self.config["trade_db"] else None
+        self.tracer = Tracer(self.config["trace_file"], clock=lambda: self.clock())
+        self.signals = SignalIngestor(self.config, clock=lambda: self.clock())
+        self.signal_chats = frozenset(self.signals.chats)
+        # 余额确认、交易重试等延迟操作统一由时间轮调度
+        self.timers = TimerWheel()
+        # 各用户的买入请求按权重公平排队，限制并发和速率
+        self.buys = BuyScheduler(
+            self.config, self.handle_contract_address, clock=lambda: self.clock(), timers=self.timers
+        )
+        self.buy_tasks = self.buys.tasks
+        self.balance_checks = {}
+        # 成交确认早于持仓登记时暂存的成交价
+        self.entry_fills = {}
+        # 进行中的买入占用的持仓名额，合约地址 → 进行中的买入数
+        self.buying = {}
+        # Telegram未连接时排队的交易指令，重连后按顺序补发
+        self.outbox = deque()
+        # 卖出指令已排队尚未发出的持仓，发出前继续监控但不重复触发止盈止损
+        self.queued_sells = set()
+        # 补发失败后的重试定时器和队首指令连续失败次数
+        self.flush_timer = None
+        self.flushing = False
+        self.outbox_failures = 0
+        self.notify_tasks = set()
+        # 其他后台任务（性能分析、刷新交易机器人实体等），关闭时统一取消
+        self.background_tasks = set()
+        # 已处理的交易机器人消息，重连后从最后一条之后补处理
+        self.last_bot_message_id = 0
+        self.bot_replies_seen = TTLSeenSet(3600, 1000, clock=lambda: self.clock())
+        self.profiling = False
+        # Telegram就绪后才能发送消息
+        self.ready = asyncio.Event()
+        self.bot_entity_cached = False
+        self._saved_state = None
+        self._saved_version = None
+
+    async def get_price(self, ca):
+        """获取合约当前价格"""
+        return await self.price_monitor.get_price(ca)
+
+    def record_transaction(self, ca, action, price, amount=None, user_id=None):
+        """记录一笔交易，持仓中的 position_id 把买入和卖出关联起来"""
+        if self.trades is None:
+            return
+        position_id = (self.price_map.get(ca) or {}).get("position_id")
+        self.trades.record(
+            ca, action, price, amount, user_id, position_id=position_id, ts=self.clock()
+        )
+
+    async def send_message(self, entity, text):
+        """发送Telegram消息并记录耗时，Telegram未就绪时等待"""
+        kind = "command" if entity in self.config.bot_entities else "notify"
+        while self.client is None:
+            await self.ready.wait()
+        started = time.perf_counter()
+        try:
+            return await self.client.send_message(entity, text)
+        finally:
+            TELEGRAM_SEND.observe(time.perf_counter() - started, kind=kind)
+
+    def register_metrics(self):
+        """注册采集时计算的指标"""
+        POSITIONS.set_function(lambda: len(self.price_map))
+        PENDING_TRANSACTIONS.set_function(lambda: len(self.pending_transactions))
+        TIMERS_PENDING.set_function(lambda: self.timers.count)
+        OUTBOX_COMMANDS.set_function(lambda: len(self.outbox))
+        PENDING_OLDEST_AGE.set_function(
+            lambda: max(
+                (self.clock() - tx["timestamp"] for tx in self.pending_transactions.values()),
+                default=0,
+            )
+        )
+
+    async def monitor_event_loop_lag(self, interval=0.5):
+        """测量事件循环延迟：定时器实际唤醒时刻与预期的差值"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+    async def handle_profile_command(self, user_id, text):
+        """处理 /profile [秒数] 指令，在后台采样事件循环线程"""
+        if self.profiling:
+            await self.send_message(user_id, "性能分析正在进行中，请稍后再试")
+            return
+        parts = text.split()
+        try:
+            seconds = float(parts[1]) if len(parts) > 1 else 30
+        except ValueError:
+            await self.send_message(user_id, "用法: /profile [秒数]")
+            return
+        seconds = max(1.0, min(seconds, self.config["profile_max_seconds"]))
+        self.profiling = True
+        self.spawn(self.run_profiler(user_id, seconds))
+        await self.send_message(user_id, f"开始性能分析，持续 {seconds:.0f} 秒...")
+
+    async def run_profiler(self, user_id, seconds):
+        """运行采样分析器并把结果写入profile_dir"""
+        try:
+            profiler = SamplingProfiler(threading.get_ident())
+            loop = asyncio.get_running_loop()
+            counts = await loop.run_in_executor(None, profiler.run, seconds)
+            os.makedirs(self.config["profile_dir"], exist_ok=True)
+            path = os.path.join(
+                self.config["profile_dir"],
+                f"profile_{time.strftime('%Y%m%d_%H%M%S')}.txt",
+            )
+            SamplingProfiler.write_collapsed(counts, path)
+            logger.info(f"性能分析完成，共 {sum(counts.values())} 个样本，已写入 {path}")
+            await self.send_message(
+                user_id, f"性能分析完成，共 {sum(counts.values())} 个样本，已写入 {path}"
+            )
+        except Exception as e:
+            logger.error(f"性能分析失败: {e}")
+        finally:
+            self.profiling = False
+
+    def load_state(self):
+        """恢复上次运行保存的交易机器人实体和持仓"""
+        path = self.config["state_file"]
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取运行状态失败: {e}")
+            return
+
+        bot = state.get("bot") or {}
+        if bot.get("username") == self.config["bot_username"] and bot.get("chat_id"):
+            if not self.config.bot_chat_id:
+                self.apply_config(self.config.replace(bot_chat_id=bot["chat_id"]))
+            self.bot_entity_cached = True
+            self.last_bot_message_id = bot.get("last_message_id") or 0
+            logger.info(f"使用缓存的交易机器人实体: {bot['chat_id']}")
+
+        positions = state.get("positions") or {}
+        for ca, data in positions.items():
+            self.price_map.setdefault(ca, data)
+        if positions:
+            logger.info(f"已恢复 {len(positions)} 个持仓的监控")
+
+    def save_state(self):
+        """保存交易机器人实体和持仓，内容未变化时跳过"""
+        path = self.config["state_file"]
+        if not path:
+            return
+        # 持仓和交易机器人实体都未变化时不必重新序列化
+        version = (self.price_map.version, self.config.bot_chat_id, self.last_bot_message_id)
+        if version == self._saved_version:
+            return
+        state = {
+            "bot": {
+                "username": self.config["bot_username"],
+                "chat_id": self.config.bot_chat_id,
+                "last_message_id": self.last_bot_message_id,
+            },
+            "positions": self.price_map,
+        }
+        try:
+            content = json.dumps(state, ensure_ascii=False, sort_keys=True)
+            if content == self._saved_state:
+                self._saved_version = version
+                return
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+            self._saved_state = content
+            self._saved_version = version
+        except Exception as e:
+            logger.error(f"保存运行状态失败: {e}")
+
+    def apply_config(self, snapshot):
+        """切换到新的配置快照，各组件在下一次读取时使用新配置"""
+        self.config = snapshot
+        self.blockchain.config = snapshot
+        self.validator.config = snapshot
+        self.price_monitor.config = snapshot
+        self.buys.config = snapshot
+        for provider in self.price_monitor.providers:
+            provider.config = snapshot
+        # 并发上限调大后立即启动排队的买入
+        self.buys.dispatch()
+
+    def reload_config(self):
+        """重新读取配置文件，校验通过后整体替换快照，返回是否有变更
+
+        校验失败时保留当前配置；只在启动时读取的配置项保留原值并提示重启。
+        """
+        try:
+            config = ConfigManager.load_config(self.config_path)
+            # 运行中解析到的交易机器人会话ID不在配置文件里
+            if not config.get("bot_chat_id") and self.config.bot_chat_id:
+                config["bot_chat_id"] = self.config.bot_chat_id
+            snapshot = ConfigSnapshot(config)
+        except Exception as e:
+            logger.error(f"配置重载失败，继续使用当前配置: {e}")
+            return False
+        changed = self.config.changed_keys(snapshot)
+        restart_keys = changed & ConfigManager.RESTART_KEYS
+        if restart_keys:
+            logger.warning(f"以下配置项需要重启才能生效: {', '.join(sorted(restart_keys))}")
+            snapshot = snapshot.replace(
+                **{key: ConfigSnapshot._thaw(self.config.get(key)) for key in restart_keys}
+            )
+            changed -= restart_keys
+        if not changed:
+            return False
+        self.apply_config(snapshot)
+        logger.info(f"配置已重新加载，变更项: {', '.join(sorted(changed))}")
+        return True
+
+    async def watch_config(self):
+        """定期检查配置文件的修改时间，变化时热重载"""
+        while True:
+            await asyncio.sleep(self.config["config_reload_interval"])
+            try:
+                mtime = os.stat(self.config_path).st_mtime_ns
+            except OSError as e:
+                logger.warning(f"无法读取配置文件状态: {e}")
+                continue
+            if mtime != self.config_mtime:
+                self.config_mtime = mtime
+                self.reload_config()
+
+    async def resolve_bot_entity(self):
+        """获取交易机器人实体，已有缓存时在后台刷新"""
+        if self.bot_entity_cached:
+            self.spawn(self._refresh_bot_entity())
+            return
+        await self._refresh_bot_entity()
+
+    async def _refresh_bot_entity(self):
+        try:
+            bot_entity = await self.client.get_entity(self.config["bot_username"])
+            logger.info(f"已获取交易机器人实体: {bot_entity.id}")
+            # 如果没有设置bot_chat_id，则使用获取到的实体ID
+            if not self.config.bot_chat_id:
+                self.apply_config(self.config.replace(bot_chat_id=bot_entity.id))
+            self.bot_entity_cached = True
+            self.save_state()
+        except Exception as e:
+            logger.warning(f"获取交易机器人实体失败: {e}")
 
     def is_authorized(self, user_id):
         """检查用户是否授权"""
-        if "authorized_users" in self.config and isinstance(
-            self.config["authorized_users"], list
-        ):
-            return user_id in self.config["authorized_users"]
+        return user_id in self.config.authorized_users
+
+    def prefilter(self, event):
+        """注册在主消息处理器上的过滤条件，在进入处理逻辑前丢弃无关消息
+
+        - 交易机器人会话和信号源的消息交给专门的处理器
+        - 群组和频道中只接受授权用户的消息，私聊中未授权用户发送合约地址会收到拒绝提示
+        - 只有合约地址和 /profile 指令会进入处理逻辑
+        """
+        if event.chat_id == self.config.bot_chat_id:
+            TELEGRAM_EVENTS_DROPPED.inc(stage="bot_chat")
+            return False
+        if event.chat_id in self.signal_chats:
+            TELEGRAM_EVENTS_DROPPED.inc(stage="signal_chat")
+            return False
+        authorized = event.sender_id in self.config.authorized_users
+        if not authorized and not event.is_private:
+            TELEGRAM_EVENTS_DROPPED.inc(stage="sender")
+            return False
+        text = (event.message.message or "").strip()
+        if text.startswith("/"):
+            if authorized and text.split()[0] == "/profile":
+                TELEGRAM_EVENTS_ACCEPTED.inc(handler="command")
+                return True
+            TELEGRAM_EVENTS_DROPPED.inc(stage="command")
+            return False
+        if not (text.startswith("0x") and len(text) == 42):
+            TELEGRAM_EVENTS_DROPPED.inc(stage="content")
+            return False
+        TELEGRAM_EVENTS_ACCEPTED.inc(handler="contract")
+        return True
+
+    def reconcile_fill(self, ca, text):
+        """用交易机器人回复中的成交价修正入场价"""
+        match = self.FILL_PRICE_RE.search(text)
+        if not match:
+            return
+        fill_price = float(match.group(1) or match.group(2))
+        if fill_price <= 0:
+            return
+        position = self.price_map.get(ca)
+        if position is None:
+            # 成交确认早于持仓登记，登记时使用
+            self.entry_fills[ca] = fill_price
+            return
+        quote_price = position.get("quote_price") or position["buy_price"]
+        position["buy_price"] = fill_price
+        if self.trades is not None and position.get("position_id"):
+            self.trades.update_price(position["position_id"], fill_price)
+        slippage = (fill_price - quote_price) / quote_price * 100
+        logger.info(
+            f"合约 {ca} 成交价: {fill_price} USD，报价: {quote_price} USD，偏差 {slippage:.2f}%"
+        )
+        self.tracer.event(
+            ca, "fill_reconciled", fill=fill_price, quote=quote_price, slippage=slippage
+        )
+        self.save_state()
+
+    def count_bot_reply(self, event):
+        TELEGRAM_EVENTS_ACCEPTED.inc(handler="bot_reply")
+        return True
+
+    async def process_bot_message(self, message):
+        """处理一条交易机器人消息，实时收到和重连补处理的同一条消息只处理一次"""
+        if message.id in self.bot_replies_seen:
+            return
+        self.bot_replies_seen.add(message.id)
+        if message.id > self.last_bot_message_id:
+            self.last_bot_message_id = message.id
+        await self.handle_bot_reply(message)
+
+    async def catch_up_bot_replies(self):
+        """补处理断线期间交易机器人发来的消息（上次处理的消息ID之后）
+
+        早于待处理交易有效期的消息不再处理：对应的交易已超时清理，重新处理
+        （例如冷启动时）只会向用户发出过时的成功或失败通知。
+        """
+        if not self.last_bot_message_id:
+            return
+        oldest = self.clock() - self.PENDING_TTL
+        count = 0
+        try:
+            async for message in self.client.iter_messages(
+                self.config.bot_target,
+                min_id=self.last_bot_message_id,
+                reverse=True,
+                limit=self.config["catch_up_limit"],
+            ):
+                if message.out:
+                    continue
+                if message.date is not None and message.date.timestamp() < oldest:
+                    # 跳过的消息也记为已处理，下次不再取出
+                    self.last_bot_message_id = max(self.last_bot_message_id, message.id)
+                    continue
+                count += 1
+                TELEGRAM_EVENTS_ACCEPTED.inc(handler="bot_reply_catch_up")
+                await self.process_bot_message(message)
+        except Exception as e:
+            logger.error(f"补处理交易机器人消息失败: {e}")
+        if count:
+            logger.info(f"已补处理断线期间的 {count} 条交易机器人消息")
+            self.save_state()
+
+    async def send_command(self, text, tx_id=None, tx=None, on_sent=None):
+        """向交易机器人发送指令，tx 为随指令登记的待处理交易，已发送时返回True
+
+        Telegram未连接或前面还有待补发的指令时进入待发队列并立即返回False，
+        不阻塞价格监控和买入流程；按顺序补发，发送时才登记待处理交易，避免排队期间被当作超时清理。
+        排队的指令补发后调用 on_sent(True)，多次失败被放弃时调用 on_sent(False)。
+        """
+        if self.client is None or self.outbox:
+            self.outbox.append((text, tx_id, tx, on_sent))
+            logger.warning(f"指令已排队等待补发: {text}")
+            # 已连接时确保有补发在进行，补发正在退避等待时不提前重试
+            if self.client is not None and not self.flushing and self.flush_timer is None:
+                self.schedule_flush(0)
+            return False
+        if tx_id:
+            self.pending_transactions[tx_id] = tx
+        await self.send_message(self.config.bot_target, text)
+        return True
+
+    def schedule_flush(self, delay):
+        """delay 秒后补发排队的指令"""
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+        self.flush_timer = self.timers.schedule(delay, self.flush_outbox)
+
+    async def flush_outbox(self):
+        """按顺序补发排队的指令
+
+        发送失败时按指数退避重试（FloodWait 按要求的秒数），队首指令连续失败
+        OUTBOX_MAX_ATTEMPTS 次后放弃并通知用户，不让后面的指令一直排在它后面。
+        """
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if self.flushing:
+            return
+        self.flushing = True
+        try:
+            while self.outbox and self.client is not None:
+                text, tx_id, tx, on_sent = self.outbox[0]
+                if tx_id:
+                    tx["timestamp"] = self.clock()
+                    self.pending_transactions[tx_id] = tx
+                try:
+                    await self.send_message(self.config.bot_target, text)
+                except Exception as e:
+                    if tx_id:
+                        self.pending_transactions.pop(tx_id, None)
+                    self.outbox_failures += 1
+                    if self.outbox_failures < self.OUTBOX_MAX_ATTEMPTS:
+                        delay = getattr(e, "seconds", None) or min(
+                            self.OUTBOX_MAX_BACKOFF, 2 ** self.outbox_failures
+                        )
+                        logger.error(f"补发指令失败，{delay} 秒后重试: {e}")
+                        if self.client is not None:
+                            self.schedule_flush(delay)
+                        return
+                    logger.error(f"指令连续 {self.outbox_failures} 次补发失败，已放弃: {text}: {e}")
+                    self.outbox.popleft()
+                    self.outbox_failures = 0
+                    if tx and tx.get("user_id"):
+                        self.notify_user(tx["user_id"], f"指令多次发送失败，已放弃: {text}\n请检查后手动处理")
+                    self.outbox_sent(on_sent, False)
+                    continue
+                self.outbox.popleft()
+                self.outbox_failures = 0
+                logger.info(f"已补发排队的指令: {text}")
+                self.outbox_sent(on_sent, True)
+        finally:
+            self.flushing = False
+
+    def outbox_sent(self, on_sent, sent):
+        """通知排队指令的发送结果，回调出错不影响后续补发"""
+        if on_sent is None:
+            return
+        try:
+            on_sent(sent)
+        except Exception as e:
+            logger.error(f"处理排队指令发送结果出错: {e}")
+
+    async def resume_session(self):
+        """重连后先补处理错过的回复，再补发排队的指令"""
+        await self.catch_up_bot_replies()
+        await self.flush_outbox()
+
+    def notify_user(self, user_id, text):
+        """在后台通知用户，Telegram未连接时等待重连，不阻塞调用方"""
+
+        async def send():
+            try:
+                await self.send_message(user_id, text)
+            except Exception as e:
+                logger.error(f"通知用户 {user_id} 失败: {e}")
+
+        task = asyncio.create_task(send())
+        self.notify_tasks.add(task)
+        task.add_done_callback(self.notify_tasks.discard)
+
+    def spawn(self, coro):
+        """在后台运行协程并保留任务引用，避免运行中被回收，关闭时统一取消"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def start_buy(self, user_id, ca, source=None):
+        """把买入请求交给调度器在后台执行，消息处理器无需等待"""
+        if self.buys.submit(user_id, ca, source):
+            return True
+        logger.warning(f"用户 {user_id} 排队的买入过多，放弃买入: {ca}")
+        self.notify_user(user_id, f"排队中的买入过多，未买入 {ca}")
         return False
 
+    def confirm_balance(self, ca, expect_balance, on_done, max_retries=3, interval=5):
+        """通过时间轮安排链上余额检查
+
+        余额状态符合预期或用完重试次数后调用 on_done(has_balance, message, attempts)。
+        同一合约新的检查会取消尚未执行的旧检查，正在执行的旧检查在下一步自行结束。
+        """
+        previous = self.balance_checks.pop(ca, None)
+        if previous is not None:
+            previous.cancel()
+        attempts = 0
+
+        def superseded():
+            # 已触发的定时器无法取消，登记的不再是本次检查时说明已被替换或持仓已清理
+            timer = self.balance_checks.get(ca)
+            return timer is None or timer.callback is not check
+
+        async def check():
+            nonlocal attempts
+            if superseded():
+                return
+            attempts += 1
+            has_balance, message = await self.blockchain.check_token_balance(
+                self.config["wallet_address"], ca
+            )
+            if superseded():
+                return
+            if has_balance == expect_balance or attempts >= max_retries:
+                self.balance_checks.pop(ca, None)
+                if has_balance:
+                    logger.info(f"链上确认持有代币 {ca} (尝试 {attempts}/{max_retries}): {message}")
+                else:
+                    logger.info(f"链上检测合约 {ca} 余额为零 (尝试 {attempts}/{max_retries}): {message}")
+                await on_done(has_balance, message, attempts)
+                return
+            if has_balance:
+                logger.warning(f"链上检测到仍持有代币 {ca} (尝试 {attempts}/{max_retries}): {message}")
+            else:
+                logger.warning(f"链上未检测到代币 {ca} (尝试 {attempts}/{max_retries}): {message}")
+            self.balance_checks[ca] = self.timers.schedule(interval, check)
+
+        self.balance_checks[ca] = self.timers.schedule(0, check)
+
+    def count_signal(self, event):
+        TELEGRAM_EVENTS_ACCEPTED.inc(handler="signal")
+        return True
+
+    def handle_signal(self, source, message):
+        """从信号消息中提取地址，去重和限额后在后台执行买入"""
+        source_config = self.signals.sources.get(source)
+        if source_config is None:
+            return []
+        addresses = SignalIngestor.extract(message)
+        if not addresses:
+            return []
+        holding = {ca.lower() for ca in self.price_map}
+        holding.update(tx["ca"].lower() for tx in self.pending_transactions.values())
+        accepted = self.signals.accept(source, addresses, holding)
+        user_id = source_config["notify_user"]
+        for ca in accepted:
+            logger.info(f"信号源 {source} 的合约地址: {ca}")
+            self.start_buy(user_id, ca, source=source)
+        return accepted
+
     def cleanup_pending_transactions(self):
         """清理超过5分钟的待处理交易"""
-        current_time = time.time()
-        expired_threshold = 300  # 5分钟
+        current_time = self.clock()
 
         for tx_id in list(self.pending_transactions.keys()):
             tx_data = self.pending_transactions[tx_id]
-            if current_time - tx_data["timestamp"] > expired_threshold:
-                logger.warning(f"交易 {tx_id} 已超过5分钟未确认，从待处理列表中移除")
-                del self.pending_transactions[tx_id]
+            if current_time - tx_data["timestamp"] > self.PENDING_TTL:
+                self.evict_pending(tx_id, "expired", "超过5分钟未确认")
+
+        # 超出上限时丢弃最早登记的待处理交易和暂存的成交价
+        max_pending = self.config["max_pending_transactions"]
+        if max_pending:
+            overflow = len(self.pending_transactions) - max_pending
+            for tx_id in list(self.pending_transactions)[:max(0, overflow)]:
+                self.evict_pending(tx_id, "over_budget", f"待处理交易超过上限 {max_pending}")
+            overflow = len(self.entry_fills) - max_pending
+            if overflow > 0:
+                for ca in list(self.entry_fills)[:overflow]:
+                    del self.entry_fills[ca]
+                logger.warning(f"暂存成交价超过上限 {max_pending}，已丢弃最早的 {overflow} 条")
+
+    def evict_pending(self, tx_id, reason, detail):
+        """丢弃一笔待确认交易：归档到交易记录并通知下单用户"""
+        tx = self.pending_transactions.pop(tx_id, None)
+        if tx is None:
+            return
+        logger.warning(f"交易 {tx_id} {detail}，从待处理列表中移除")
+        ca = tx["ca"]
+        if self.trades is not None:
+            self.trades.record(
+                ca, "evict", None, user_id=tx.get("user_id"), position_id=tx.get("position_id"),
+                ts=self.clock(), reason=f"pending_{reason}",
+            )
+        user_id = tx.get("user_id")
+        if user_id:
+            action = "买入" if tx["type"] == "buy" else "卖出"
+            self.notify_user(
+                user_id,
+                f"""{action}指令未确认 {ca}
+原因: {detail}
+已停止等待交易机器人的确认，请在交易机器人中核对该订单""",
+            )
 
     async def connect_client(self):
         """连接到Telegram客户端，包含重连逻辑"""
@@ -388,17 +3040,181 @@ class BSCBot:
             logger.error(f"连接Telegram失败: {e}")
             raise
 
+    async def handle_contract_address(self, user_id, ca, source=None, release=None):
+        """验证合约地址，发送买入指令并开始监控价格
+
+        release 由买入调度器传入，买入指令交给 send_command 后调用，释放调度名额。
+        """
+        try:
+            await self._buy_contract_address(user_id, ca, source, release)
+        except Exception as e:
+            logger.error(f"处理合约地址 {ca} 时出错: {e}")
+
+    async def _buy_contract_address(self, user_id, ca, source, release=None):
+        trace_id = self.tracer.start_trace(ca, user_id)
+        if source:
+            self.tracer.event(ca, "signal", source=source)
+
+        # 持仓数达到上限时不再买入，避免买入后无法监控
+        if not self.reserve_position(ca):
+            max_positions = self.config["max_positions"]
+            logger.warning(f"持仓数已达上限 {max_positions}，放弃买入: {ca}")
+            self.tracer.end_trace(ca, "over_budget")
+            self.notify_user(user_id, f"持仓数已达上限 {max_positions}，未买入 {ca}")
+            return
+        try:
+            await self._verify_and_buy(user_id, ca, trace_id, release)
+        finally:
+            self.release_position(ca)
+
+    def reserve_position(self, ca):
+        """为进行中的买入占用持仓名额，持仓数（含进行中的买入）已达上限时返回False
+
+        检查和占用之间没有await，并发的买入不会同时通过上限检查。
+        """
+        max_positions = self.config["max_positions"]
+        if max_positions and ca not in self.price_map and ca not in self.buying:
+            in_use = len(self.price_map) + sum(1 for other in self.buying if other not in self.price_map)
+            if in_use >= max_positions:
+                return False
+        self.buying[ca] = self.buying.get(ca, 0) + 1
+        return True
+
+    def release_position(self, ca):
+        count = self.buying.pop(ca, 1) - 1
+        if count:
+            self.buying[ca] = count
+
+    async def _verify_and_buy(self, user_id, ca, trace_id, release=None):
+        # 验证合约的同时预取价格
+        prefetch_task = asyncio.create_task(self.get_price(ca))
+
+        # 验证合约地址是否存在
+        with self.tracer.span(trace_id, "verify_contract") as span:
+            is_valid, message = await self.validator.verify_contract(ca)
+            span.set(valid=is_valid)
+        if not is_valid:
+            prefetch_task.cancel()
+            logger.warning(f"无效的合约地址: {ca}, 原因: {message}")
+            self.tracer.end_trace(ca, "invalid_contract")
+            self.notify_user(user_id, f"无效的合约地址: {message}")
+            return
+
+        logger.info(f"合约地址验证通过: {ca}")
+        self.notify_user(user_id, "合约地址验证通过，准备买入...")
+
+        # 发送 /buy 指令到交易机器人
+        buy_cmd = f"/buy {ca} {self.config['buy_amount']}"
+
+        # 随指令登记待处理的买入交易，添加重试计数
+        tx_id = f"buy_{ca}_{int(self.clock())}"
+        tx = {
+            "ca": ca,
+            "type": "buy",
+            "user_id": user_id,
+            "timestamp": self.clock(),
+            "retry_count": 0,  # 初始化重试计数
+            "max_retries": self.config["max_transaction_retries"],
+            "trace_id": trace_id,
+        }
+
+        # 发送指令的同时刷新价格，作为成交确认前的入场价
+        quote_task = asyncio.create_task(self.get_price(ca))
+        delivered = asyncio.get_running_loop().create_future()
+
+        def on_sent(sent):
+            if not delivered.done():
+                delivered.set_result(sent)
+
+        with self.tracer.span(trace_id, "buy_send"):
+            sent = await self.send_command(buy_cmd, tx_id, tx, on_sent)
+        # 指令已发出或已进入待发队列，后面的等待不再占用买入调度名额
+        if release is not None:
+            release()
+        if not sent:
+            # 指令排队时先告知用户，补发后再等待成交确认，入场价以补发时的报价为准
+            self.notify_user(user_id, f"Telegram连接异常，买入指令已排队，恢复后发送: {ca}")
+            quote_task.cancel()
+            with self.tracer.span(trace_id, "buy_queued"):
+                sent = await delivered
+            if not sent:
+                prefetch_task.cancel()
+                self.tracer.end_trace(ca, "buy_not_sent")
+                self.notify_user(user_id, f"买入指令发送失败，未买入 {ca}")
+                return
+            quote_task = asyncio.create_task(self.get_price(ca))
+        self.tracer.mark(ca, "buy_sent")
+        logger.info(f"已发送买入指令: {buy_cmd}")
+
+        # 等待几秒确认交易完成
+        with self.tracer.span(trace_id, "buy_confirmation_delay"):
+            await self.timers.sleep(self.config["buy_confirmation_delay"])
+
+        # 优先使用发送指令时的报价，其次是预取的价格，都没有时重试获取价格，最多3次
+        with self.tracer.span(trace_id, "price_fetch") as span:
+            prefetch_price, quote_price = [
+                None if isinstance(result, BaseException) else result
+                for result in await asyncio.gather(
+                    prefetch_task, quote_task, return_exceptions=True
+                )
+            ]
+            price = quote_price or prefetch_price
+            span.set(prefetch=prefetch_price, quote=quote_price, attempts=0, price=price)
+            if not price:
+                for attempt in range(3):
+                    price = await self.get_price(ca)
+                    span.set(attempts=attempt + 1, price=price)
+                    if price:
+                        break
+                    logger.warning(f"获取价格尝试 {attempt+1}/3 失败，重试中...")
+                    await self.timers.sleep(2)
+
+        fill_price = self.entry_fills.pop(ca, None)
+        if price or fill_price:
+            self.price_map[ca] = {
+                "buy_price": fill_price or price,
+                "quote_price": price or fill_price,
+                "buy_time": self.clock(),
+                "take_profit": self.config["target_gain_percent"],
+                "stop_loss": self.config["stop_loss_percent"],
+                "user_id": user_id,  # 记录下单用户ID
+                "trace_id": trace_id,
+                "position_id": TradeStore.new_position_id(),
+            }
+            price = self.price_map[ca]["buy_price"]
+            logger.info(f"用户 {user_id} 买入 {ca} 价格: {price} USD")
+            self.record_transaction(
+                ca, "buy", price, self.config["buy_amount"], user_id
+            )
+            self.save_state()
+
+            self.notify_user(
+                user_id,
+                f"""已买入 {ca}
+买入价格: ${price:.8f}
+止盈设置: {self.config["target_gain_percent"]}%
+止损设置: {self.config["stop_loss_percent"]}%
+开始监控价格变化...""",
+            )
+        else:
+            logger.error(f"无法获取价格，已放弃监控该合约: {ca}")
+            self.tracer.end_trace(ca, "no_price")
+            self.notify_user(user_id, "无法获取价格，交易可能已完成但无法监控价格变化")
+
     async def setup_message_handler(self):
         """设置消息处理器"""
 
-        @self.client.on(events.NewMessage)
+        # 不限定 incoming，账号本人发出的合约地址同样处理
+        @self.client.on(events.NewMessage(func=self.prefilter))
         async def handler(event):
             try:
                 user_id = event.sender_id
                 text = event.message.message.strip()
 
-                # 处理命令 (忽略所有命令)
+                # 处理命令 (除性能分析指令外忽略所有命令)
                 if text.startswith("/"):
+                    if text.split()[0] == "/profile" and self.is_authorized(user_id):
+                        await self.handle_profile_command(user_id, text)
                     return
 
                 # 处理合约地址，只接受授权用户的消息
@@ -406,666 +3222,758 @@ class BSCBot:
                     # 检查用户是否授权
                     if not self.is_authorized(user_id):
                         logger.warning(f"未授权用户 {user_id} 尝试发送合约地址: {text}")
-                        await self.client.send_message(user_id, "您没有权限使用此功能")
+                        await self.send_message(user_id, "您没有权限使用此功能")
                         return
 
                     ca = text
                     logger.info(f"收到授权用户 {user_id} 的合约地址: {ca}")
+                    self.signals.mark_seen(ca)
+                    self.start_buy(user_id, ca)
 
-                    # 验证合约地址是否存在
-                    is_valid, message = await self.validator.verify_contract(ca)
-                    if not is_valid:
-                        logger.warning(f"无效的合约地址: {ca}, 原因: {message}")
-                        await self.client.send_message(
-                            user_id, f"无效的合约地址: {message}"
-                        )
-                        return
-
-                    logger.info(f"合约地址验证通过: {ca}")
-                    await self.client.send_message(
-                        user_id, f"合约地址验证通过，准备买入..."
-                    )
+            except Exception as e:
+                logger.error(f"处理消息时出错: {e}")
 
-                    # 发送 /buy 指令到交易机器人
-                    buy_cmd = f"/buy {ca} {self.config['buy_amount']}"
-                    target = (
-                        self.config.get("bot_chat_id", "")
-                        or self.config["bot_username"]
-                    )
+        # 监听信号频道和群组
+        if self.signals.sources:
 
-                    # 记录待处理的买入交易，添加重试计数
-                    tx_id = f"buy_{ca}_{int(time.time())}"
-                    self.pending_transactions[tx_id] = {
-                        "ca": ca,
-                        "type": "buy",
-                        "user_id": user_id,
-                        "timestamp": time.time(),
-                        "retry_count": 0,  # 初始化重试计数
-                        "max_retries": self.config["max_transaction_retries"],
-                    }
-
-                    await self.client.send_message(target, buy_cmd)
-                    logger.info(f"已发送买入指令: {buy_cmd}")
-
-                    # 等待几秒确认交易完成
-                    await asyncio.sleep(self.config["buy_confirmation_delay"])
-
-                    # 重试获取价格，最多3次
-                    price = None
-                    for attempt in range(3):
-                        price = await PriceMonitor.get_price_dexscreener(ca)
-                        if price:
-                            break
-                        logger.warning(f"获取价格尝试 {attempt+1}/3 失败，重试中...")
-                        await asyncio.sleep(2)
+            @self.client.on(
+                events.NewMessage(
+                    chats=self.signals.chats, incoming=True, func=self.count_signal
+                )
+            )
+            async def signal_handler(event):
+                try:
+                    self.handle_signal(event.chat_id, event.message)
+                except Exception as e:
+                    logger.error(f"处理信号消息时出错: {e}")
+
+        # 监听交易机器人的回复，只匹配交易机器人会话
+        @self.client.on(
+            events.NewMessage(
+                chats=self.config.bot_target,
+                incoming=True,
+                func=self.count_bot_reply,
+            )
+        )
+        async def bot_response_handler(event):
+            await self.process_bot_message(event.message)
 
-                    if price:
-                        self.price_map[ca] = {
-                            "buy_price": price,
-                            "buy_time": time.time(),
-                            "take_profit": self.config["target_gain_percent"],
-                            "stop_loss": self.config["stop_loss_percent"],
-                            "user_id": user_id,  # 记录下单用户ID
-                        }
-                        logger.info(f"用户 {user_id} 买入 {ca} 价格: {price} USD")
-                        TransactionManager.save_transaction(
-                            ca, "buy", price, self.config["buy_amount"], user_id
-                        )
+    async def handle_bot_reply(self, message):
+        """处理交易机器人的一条回复：买入/卖出成功、交易失败"""
+        try:
+            text = message.message.strip()
+            logger.info(f"收到交易机器人消息: {LogManager.shorten(text)}")
 
-                        await self.client.send_message(
-                            user_id,
-                            f"""已买入 {ca}
-买入价格: ${price:.8f}
-止盈设置: {self.config["target_gain_percent"]}%
-止损设置: {self.config["stop_loss_percent"]}%
-开始监控价格变化...""",
-                        )
-                    else:
-                        logger.error(f"无法获取价格，已放弃监控该合约: {ca}")
-                        await self.client.send_message(
-                            user_id, "无法获取价格，交易可能已完成但无法监控价格变化"
+            # 检测买入成功的消息
+            if (
+                "已成功买入" in text
+                or "successfully bought" in text.lower()
+                or ("交易成功" in text and "买入" in text)
+            ):
+                # 先尝试从消息中提取合约地址
+                contract_match = re.search(r"0x[a-fA-F0-9]{40}", text)
+                ca = None
+
+                if contract_match:
+                    ca = contract_match.group(0)
+                else:
+                    # 如果没有直接找到合约地址，尝试从交易哈希获取
+                    tx_hash = TransactionManager.extract_transaction_hash(
+                        message
+                    )
+                    if tx_hash:
+                        logger.info(f"从消息中提取到交易哈希: {tx_hash}")
+                        ca = await self.blockchain.get_contract_address_from_transaction(
+                            tx_hash
                         )
+                        if ca:
+                            logger.info(f"从交易 {tx_hash} 中获取到合约地址: {ca}")
 
-            except Exception as e:
-                logger.error(f"处理消息时出错: {e}")
+                if ca:
+                    self.tracer.event_since(ca, "buy_confirmed", "buy_sent")
+                    self.reconcile_fill(ca, text)
 
-        # 监听交易机器人的回复
-        @self.client.on(events.NewMessage(from_users=self.config["bot_username"]))
-        async def bot_response_handler(event):
-            try:
-                text = event.message.message.strip()
-                logger.info(f"收到交易机器人消息: {text}")
+                    # 清理相关的待处理交易
+                    for tx_id in list(self.pending_transactions.keys()):
+                        if (
+                            self.pending_transactions[tx_id]["ca"] == ca
+                            and self.pending_transactions[tx_id]["type"] == "buy"
+                        ):
+                            logger.info(
+                                f"买入交易 {tx_id} 已成功，从待处理列表中移除"
+                            )
+                            del self.pending_transactions[tx_id]
+
+                    # 买入成功后立即检查余额
+                    if self.config["wallet_address"] and ca in self.price_map:
+                        logger.info(f"买入成功后检查合约 {ca} 的余额")
+                        self.tracer.mark(ca, "balance_check")
+                        self.confirm_balance(ca, True, self.make_buy_balance_callback(ca))
+                else:
+                    logger.warning("检测到买入成功消息，但无法提取合约地址")
+
+            # 检测交易失败的消息
+            elif "链上交易失败" in text or "滑点不够" in text:
+                logger.warning(f"检测到交易失败消息: {text}")
+
+                # 查找最近的待处理交易
+                if self.pending_transactions:
+                    # 按时间戳排序，获取最近的交易
+                    sorted_transactions = sorted(
+                        self.pending_transactions.items(),
+                        key=lambda x: x[1]["timestamp"],
+                        reverse=True,
+                    )
 
-                # 检测买入成功的消息
-                if (
-                    "已成功买入" in text
-                    or "successfully bought" in text.lower()
-                    or ("交易成功" in text and "买入" in text)
-                ):
-                    # 先尝试从消息中提取合约地址
-                    contract_match = re.search(r"0x[a-fA-F0-9]{40}", text)
-                    ca = None
+                    if sorted_transactions:
+                        tx_id, tx_data = sorted_transactions[0]
+                        ca = tx_data["ca"]
+                        tx_type = tx_data["type"]
+                        user_id = tx_data["user_id"]
 
-                    if contract_match:
-                        ca = contract_match.group(0)
-                    else:
-                        # 如果没有直接找到合约地址，尝试从交易哈希获取
-                        tx_hash = TransactionManager.extract_transaction_hash(
-                            event.message
+                        # 检查是否需要重试
+                        retry_count = tx_data.get("retry_count", 0)
+                        max_retries = tx_data.get(
+                            "max_retries", self.config["max_transaction_retries"]
                         )
-                        if tx_hash:
-                            logger.info(f"从消息中提取到交易哈希: {tx_hash}")
-                            ca = await self.blockchain.get_contract_address_from_transaction(
-                                tx_hash
-                            )
-                            if ca:
-                                logger.info(f"从交易 {tx_hash} 中获取到合约地址: {ca}")
-
-                    if ca:
-                        # 清理相关的待处理交易
-                        for tx_id in list(self.pending_transactions.keys()):
-                            if (
-                                self.pending_transactions[tx_id]["ca"] == ca
-                                and self.pending_transactions[tx_id]["type"] == "buy"
-                            ):
-                                logger.info(
-                                    f"买入交易 {tx_id} 已成功，从待处理列表中移除"
-                                )
-                                del self.pending_transactions[tx_id]
-
-                        # 买入成功后立即检查余额
-                        if self.config["wallet_address"] and ca in self.price_map:
-                            logger.info(f"买入成功后检查合约 {ca} 的余额")
-                            has_balance = False
-                            max_retries = 3
-
-                            for retry in range(max_retries):
-                                has_balance, message = (
-                                    await self.blockchain.check_token_balance(
-                                        self.config["wallet_address"], ca
-                                    )
-                                )
 
-                                if has_balance:
-                                    logger.info(
-                                        f"链上确认持有代币 (尝试 {retry+1}/{max_retries}): {message}"
-                                    )
-                                    # 标记该合约已经确认持有代币
-                                    self.price_map[ca]["balance_confirmed"] = True
-                                    break
-                                else:
-                                    logger.warning(
-                                        f"链上未检测到代币 (尝试 {retry+1}/{max_retries}): {message}"
-                                    )
-                                    if (
-                                        retry < max_retries - 1
-                                    ):  # 如果不是最后一次尝试，则等待
-                                        await asyncio.sleep(5)  # 等待5秒再次检查
-
-                            if not has_balance:
-                                logger.warning(
-                                    f"买入后多次检查仍未在链上检测到代币 {ca}"
-                                )
-                                # 通知用户但继续监控
-                                user_id = self.price_map[ca].get("user_id")
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"警告: 交易机器人报告买入成功，但链上未检测到代币 {ca}，将继续监控价格变化",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
-                        else:
-                            logger.warning("检测到买入成功消息，但无法提取合约地址")
-
-                # 检测交易失败的消息
-                elif "链上交易失败" in text or "滑点不够" in text:
-                    logger.warning(f"检测到交易失败消息: {text}")
-
-                    # 查找最近的待处理交易
-                    if self.pending_transactions:
-                        # 按时间戳排序，获取最近的交易
-                        sorted_transactions = sorted(
-                            self.pending_transactions.items(),
-                            key=lambda x: x[1]["timestamp"],
-                            reverse=True,
+                        self.tracer.event(
+                            ca, "transaction_failed", type=tx_type,
+                            retry_count=retry_count, reason=text[:200],
                         )
 
-                        if sorted_transactions:
-                            tx_id, tx_data = sorted_transactions[0]
-                            ca = tx_data["ca"]
-                            tx_type = tx_data["type"]
-                            user_id = tx_data["user_id"]
+                        if retry_count < max_retries - 1:  # 还可以重试
+                            # 增加重试计数
+                            retry_count += 1
+                            logger.info(
+                                f"{tx_type.capitalize()}交易失败，准备第 {retry_count+1}/{max_retries} 次重试: {ca}"
+                            )
 
-                            # 检查是否需要重试
-                            retry_count = tx_data.get("retry_count", 0)
-                            max_retries = tx_data.get(
-                                "max_retries", self.config["max_transaction_retries"]
+                            # 更新交易记录
+                            new_tx_id = f"{tx_type}_{ca}_{int(self.clock())}"
+                            new_tx = self.pending_transactions[new_tx_id] = {
+                                "ca": ca,
+                                "type": tx_type,
+                                "user_id": user_id,
+                                "timestamp": self.clock(),
+                                "retry_count": retry_count,
+                                "max_retries": max_retries,
+                                "trace_id": tx_data.get("trace_id"),
+                            }
+
+                            # 从旧的待处理交易中移除
+                            del self.pending_transactions[tx_id]
+
+                            # 等待一段时间后由时间轮重新发送交易指令
+                            self.tracer.mark(ca, "retry_delay")
+                            self.timers.schedule(
+                                self.config["retry_delay"],
+                                self.resend_transaction,
+                                ca, tx_type, user_id, retry_count, max_retries, new_tx_id, new_tx,
+                            )
+                        else:
+                            # 达到最大重试次数，放弃交易
+                            logger.warning(
+                                f"{tx_type.capitalize()}交易在 {max_retries} 次尝试后仍然失败: {ca}"
                             )
 
-                            if retry_count < max_retries - 1:  # 还可以重试
-                                # 增加重试计数
-                                retry_count += 1
+                            # 从待处理交易中移除
+                            del self.pending_transactions[tx_id]
+
+                            # 如果是买入交易失败，检查是否已经添加到price_map中，如果是则移除
+                            if tx_type == "buy" and ca in self.price_map:
+                                del self.price_map[ca]
                                 logger.info(
-                                    f"{tx_type.capitalize()}交易失败，准备第 {retry_count+1}/{max_retries} 次重试: {ca}"
+                                    f"由于买入多次失败，已停止监控合约 {ca}"
                                 )
+                            if tx_type == "buy":
+                                self.entry_fills.pop(ca, None)
+                                self.tracer.end_trace(ca, "buy_failed")
 
-                                # 更新交易记录
-                                new_tx_id = f"{tx_type}_{ca}_{int(time.time())}"
-                                self.pending_transactions[new_tx_id] = {
-                                    "ca": ca,
-                                    "type": tx_type,
-                                    "user_id": user_id,
-                                    "timestamp": time.time(),
-                                    "retry_count": retry_count,
-                                    "max_retries": max_retries,
-                                }
-
-                                # 从旧的待处理交易中移除
-                                del self.pending_transactions[tx_id]
-
-                                # 等待一段时间后重试
-                                await asyncio.sleep(self.config["retry_delay"])
-
-                                # 重新发送交易指令
-                                target = (
-                                    self.config.get("bot_chat_id", "")
-                                    or self.config["bot_username"]
-                                )
+                        if user_id:
+                            try:
+                                # 通知用户交易失败
+                                failure_message = f"警告: {tx_type}合约 {ca} 的交易失败，原因: {text}\n"
                                 if tx_type == "buy":
-                                    cmd = f"/buy {ca} {self.config['buy_amount']}"
+                                    failure_message += "请检查滑点设置或稍后重试。"
                                 else:  # sell
-                                    cmd = f"/sell {ca} 100"
-
-                                await self.client.send_message(target, cmd)
-                                logger.info(f"已重新发送{tx_type}指令: {cmd}")
-
-                                # 通知用户正在重试
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"{tx_type.capitalize()}交易失败，正在进行第 {retry_count+1}/{max_retries} 次重试...",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
-                            else:
-                                # 达到最大重试次数，放弃交易
-                                logger.warning(
-                                    f"{tx_type.capitalize()}交易在 {max_retries} 次尝试后仍然失败: {ca}"
+                                    failure_message += "卖出失败，将继续监控价格变化。请手动检查或稍后重试卖出。"
+
+                                await self.send_message(
+                                    user_id, failure_message
+                                )
+                                logger.info(f"已通知用户 {user_id} 交易失败")
+                            except Exception as e:
+                                logger.error(f"通知用户 {user_id} 失败: {e}")
+                    else:
+                        logger.warning(
+                            "检测到交易失败消息，但没有找到最近的待处理交易"
+                        )
+                else:
+                    # 备用方案：尝试从最近的监控列表中找
+                    recent_contracts = list(self.price_map.keys())
+                    if recent_contracts:
+                        # 获取最近添加的合约（假设是当前操作的合约）
+                        latest_contract = recent_contracts[-1]
+                        user_id = self.price_map[latest_contract].get("user_id")
+
+                        if user_id:
+                            try:
+                                # 通知用户交易失败
+                                await self.send_message(
+                                    user_id,
+                                    f"警告: 合约 {latest_contract} 的交易失败，原因: {text}\n请手动检查交易状态或重试。",
                                 )
+                                logger.info(f"已通知用户 {user_id} 交易失败")
+                            except Exception as e:
+                                logger.error(f"通知用户 {user_id} 失败: {e}")
+                    else:
+                        logger.warning("检测到交易失败消息，但无法确定相关合约地址")
 
-                                # 从待处理交易中移除
-                                del self.pending_transactions[tx_id]
+            # 检测卖出成功的消息
+            elif (
+                "已成功卖出" in text
+                or "successfully sold" in text.lower()
+                or ("交易成功" in text and "卖出" in text)
+            ):
+                # 先尝试从消息中提取合约地址
+                contract_match = re.search(r"0x[a-fA-F0-9]{40}", text)
+                ca = None
+
+                if contract_match:
+                    ca = contract_match.group(0)
+                else:
+                    # 如果没有直接找到合约地址，尝试从交易哈希获取
+                    tx_hash = TransactionManager.extract_transaction_hash(
+                        message
+                    )
+                    if tx_hash:
+                        logger.info(f"从消息中提取到交易哈希: {tx_hash}")
+                        ca = await self.blockchain.get_contract_address_from_transaction(
+                            tx_hash
+                        )
+                        if ca:
+                            logger.info(f"从交易 {tx_hash} 中获取到合约地址: {ca}")
 
-                                # 如果是买入交易失败，检查是否已经添加到price_map中，如果是则移除
-                                if tx_type == "buy" and ca in self.price_map:
-                                    del self.price_map[ca]
-                                    logger.info(
-                                        f"由于买入多次失败，已停止监控合约 {ca}"
-                                    )
+                if ca:
+                    self.tracer.event_since(ca, "sell_confirmed", "sell_sent")
 
-                            if user_id:
-                                try:
-                                    # 通知用户交易失败
-                                    failure_message = f"警告: {tx_type}合约 {ca} 的交易失败，原因: {text}\n"
-                                    if tx_type == "buy":
-                                        failure_message += "请检查滑点设置或稍后重试。"
-                                    else:  # sell
-                                        failure_message += "卖出失败，将继续监控价格变化。请手动检查或稍后重试卖出。"
-
-                                    await self.client.send_message(
-                                        user_id, failure_message
-                                    )
-                                    logger.info(f"已通知用户 {user_id} 交易失败")
-                                except Exception as e:
-                                    logger.error(f"通知用户 {user_id} 失败: {e}")
-                        else:
-                            logger.warning(
-                                "检测到交易失败消息，但没有找到最近的待处理交易"
+                    # 清理相关的待处理交易
+                    for tx_id in list(self.pending_transactions.keys()):
+                        if (
+                            self.pending_transactions[tx_id]["ca"] == ca
+                            and self.pending_transactions[tx_id]["type"] == "sell"
+                        ):
+                            logger.info(
+                                f"卖出交易 {tx_id} 已成功，从待处理列表中移除"
                             )
-                    else:
-                        # 备用方案：尝试从最近的监控列表中找
-                        recent_contracts = list(self.price_map.keys())
-                        if recent_contracts:
-                            # 获取最近添加的合约（假设是当前操作的合约）
-                            latest_contract = recent_contracts[-1]
-                            user_id = self.price_map[latest_contract].get("user_id")
+                            del self.pending_transactions[tx_id]
 
+                    if ca in self.price_map:
+                        logger.info(f"检测到合约 {ca} 已成功卖出，准备检查链上余额")
+
+                        # 如果配置了钱包地址，验证链上余额
+                        if self.config["wallet_address"]:
+                            self.tracer.mark(ca, "sell_balance_check")
+                            self.confirm_balance(
+                                ca, False, self.make_sell_balance_callback(ca)
+                            )
+                        else:
+                            # 如果没有配置钱包地址，直接停止监控
+                            # 如果有用户ID，通知用户
+                            user_id = self.price_map[ca].get("user_id")
                             if user_id:
                                 try:
-                                    # 通知用户交易失败
-                                    await self.client.send_message(
+                                    await self.send_message(
                                         user_id,
-                                        f"警告: 合约 {latest_contract} 的交易失败，原因: {text}\n请手动检查交易状态或重试。",
+                                        f"检测到合约 {ca} 已成功卖出，停止监控价格变化",
                                     )
-                                    logger.info(f"已通知用户 {user_id} 交易失败")
                                 except Exception as e:
                                     logger.error(f"通知用户 {user_id} 失败: {e}")
-                        else:
-                            logger.warning("检测到交易失败消息，但无法确定相关合约地址")
-
-                # 检测卖出成功的消息
-                elif (
-                    "已成功卖出" in text
-                    or "successfully sold" in text.lower()
-                    or ("交易成功" in text and "卖出" in text)
-                ):
-                    # 先尝试从消息中提取合约地址
-                    contract_match = re.search(r"0x[a-fA-F0-9]{40}", text)
-                    ca = None
 
-                    if contract_match:
-                        ca = contract_match.group(0)
+                            # 从监控列表中移除
+                            del self.price_map[ca]
+                            self.tracer.end_trace(ca, "sold")
                     else:
-                        # 如果没有直接找到合约地址，尝试从交易哈希获取
-                        tx_hash = TransactionManager.extract_transaction_hash(
-                            event.message
+                        logger.warning(
+                            f"检测到合约 {ca} 卖出成功，但不在监控列表中"
                         )
-                        if tx_hash:
-                            logger.info(f"从消息中提取到交易哈希: {tx_hash}")
-                            ca = await self.blockchain.get_contract_address_from_transaction(
-                                tx_hash
-                            )
-                            if ca:
-                                logger.info(f"从交易 {tx_hash} 中获取到合约地址: {ca}")
-
-                    if ca:
-                        # 清理相关的待处理交易
-                        for tx_id in list(self.pending_transactions.keys()):
-                            if (
-                                self.pending_transactions[tx_id]["ca"] == ca
-                                and self.pending_transactions[tx_id]["type"] == "sell"
-                            ):
-                                logger.info(
-                                    f"卖出交易 {tx_id} 已成功，从待处理列表中移除"
-                                )
-                                del self.pending_transactions[tx_id]
-
-                        if ca in self.price_map:
-                            logger.info(f"检测到合约 {ca} 已成功卖出，准备检查链上余额")
-
-                            # 如果配置了钱包地址，验证链上余额
-                            if self.config["wallet_address"]:
-                                # 添加重试逻辑，最多重试3次
-                                has_balance = False
-                                max_retries = 3
-
-                                for retry in range(max_retries):
-                                    has_balance, message = (
-                                        await self.blockchain.check_token_balance(
-                                            self.config["wallet_address"], ca
-                                        )
-                                    )
+                        self.tracer.end_trace(ca, "sold")
+                else:
+                    logger.warning("检测到卖出成功消息，但无法提取合约地址")
 
-                                    if not has_balance:
-                                        # 如果没有余额，表示已经成功卖出
-                                        logger.info(
-                                            f"链上检测合约 {ca} 余额为零 (尝试 {retry+1}/{max_retries}): {message}"
-                                        )
-                                        break
-                                    else:
-                                        # 如果有余额，可能交易尚未确认，等待
-                                        logger.warning(
-                                            f"链上检测到仍持有代币 (尝试 {retry+1}/{max_retries}): {message}"
-                                        )
-                                        if (
-                                            retry < max_retries - 1
-                                        ):  # 如果不是最后一次尝试，则等待
-                                            await asyncio.sleep(5)  # 等待5秒再次检查
-
-                                # 如果经过多次检查后仍然持有代币
-                                if has_balance:
-                                    logger.warning(
-                                        f"链上多次检测到仍持有代币: {message}，继续监控"
-                                    )
-                                    # 通知用户但继续监控
-                                    user_id = self.price_map[ca].get("user_id")
-                                    if user_id:
-                                        try:
-                                            await self.client.send_message(
-                                                user_id,
-                                                f"警告: 交易机器人报告卖出成功，但链上多次检测到仍持有代币 {ca}，继续监控价格变化",
-                                            )
-                                        except Exception as e:
-                                            logger.error(
-                                                f"通知用户 {user_id} 失败: {e}"
-                                            )
-                                else:
-                                    # 如果没有余额，表示已经成功卖出
-                                    logger.info(
-                                        f"链上确认合约 {ca} 已成功卖出，停止监控"
-                                    )
+        except Exception as e:
+            logger.error(f"处理交易机器人消息时出错: {e}")
 
-                                    # 如果有用户ID，通知用户
-                                    user_id = self.price_map[ca].get("user_id")
-                                    if user_id:
-                                        try:
-                                            await self.client.send_message(
-                                                user_id,
-                                                f"链上确认合约 {ca} 已成功卖出，停止监控价格变化",
-                                            )
-                                        except Exception as e:
-                                            logger.error(
-                                                f"通知用户 {user_id} 失败: {e}"
-                                            )
-
-                                    # 从监控列表中移除
-                                    del self.price_map[ca]
-                            else:
-                                # 如果没有配置钱包地址，直接停止监控
-                                # 如果有用户ID，通知用户
-                                user_id = self.price_map[ca].get("user_id")
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"检测到合约 {ca} 已成功卖出，停止监控价格变化",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
-
-                                # 从监控列表中移除
-                                del self.price_map[ca]
-                        else:
-                            logger.warning(
-                                f"检测到合约 {ca} 卖出成功，但不在监控列表中"
-                            )
-                    else:
-                        logger.warning("检测到卖出成功消息，但无法提取合约地址")
+    def make_buy_balance_callback(self, ca):
+        """买入成功后的余额确认结果"""
 
-            except Exception as e:
-                logger.error(f"处理交易机器人消息时出错: {e}")
+        async def on_done(has_balance, message, attempts):
+            self.tracer.event_since(
+                ca, "balance_confirm", "balance_check",
+                confirmed=has_balance, attempts=attempts,
+            )
+            if ca not in self.price_map:
+                return
+            if has_balance:
+                # 标记该合约已经确认持有代币
+                self.price_map[ca]["balance_confirmed"] = True
+                return
+            logger.warning(f"买入后多次检查仍未在链上检测到代币 {ca}")
+            # 通知用户但继续监控
+            user_id = self.price_map[ca].get("user_id")
+            if user_id:
+                try:
+                    await self.send_message(
+                        user_id,
+                        f"警告: 交易机器人报告买入成功，但链上未检测到代币 {ca}，将继续监控价格变化",
+                    )
+                except Exception as e:
+                    logger.error(f"通知用户 {user_id} 失败: {e}")
+
+        return on_done
+
+    def make_sell_balance_callback(self, ca):
+        """卖出成功后的余额确认结果"""
+
+        async def on_done(has_balance, message, attempts):
+            self.tracer.event_since(
+                ca, "sell_balance_confirm", "sell_balance_check",
+                cleared=not has_balance, attempts=attempts,
+            )
+            if ca not in self.price_map:
+                self.tracer.end_trace(ca, "sold")
+                return
+            user_id = self.price_map[ca].get("user_id")
+            # 如果经过多次检查后仍然持有代币
+            if has_balance:
+                logger.warning(f"链上多次检测到仍持有代币: {message}，继续监控")
+                # 通知用户但继续监控
+                if user_id:
+                    try:
+                        await self.send_message(
+                            user_id,
+                            f"警告: 交易机器人报告卖出成功，但链上多次检测到仍持有代币 {ca}，继续监控价格变化",
+                        )
+                    except Exception as e:
+                        logger.error(f"通知用户 {user_id} 失败: {e}")
+                return
+
+            # 如果没有余额，表示已经成功卖出
+            logger.info(f"链上确认合约 {ca} 已成功卖出，停止监控")
+            if user_id:
+                try:
+                    await self.send_message(
+                        user_id,
+                        f"链上确认合约 {ca} 已成功卖出，停止监控价格变化",
+                    )
+                except Exception as e:
+                    logger.error(f"通知用户 {user_id} 失败: {e}")
+
+            # 从监控列表中移除
+            self.price_map.pop(ca, None)
+            self.tracer.end_trace(ca, "sold")
+
+        return on_done
+
+    def make_monitor_balance_callback(self, ca):
+        """价格监控中的余额检查结果"""
+
+        async def on_done(has_balance, message, attempts):
+            if ca not in self.price_map:
+                return
+            data = self.price_map[ca]
+            user_id = data.get("user_id")
+            if not has_balance:
+                # 如果确认没有余额，从监控列表中移除
+                if user_id:
+                    try:
+                        await self.send_message(
+                            user_id,
+                            f"链上检测到合约 {ca} 已卖出，停止监控价格变化",
+                        )
+                    except Exception as e:
+                        logger.error(f"通知用户 {user_id} 失败: {e}")
+
+                # 从监控列表中移除
+                self.price_map.pop(ca, None)
+                self.tracer.end_trace(ca, "balance_zero")
+                return
+
+            # 如果经过多次检查后仍然持有代币
+            logger.warning(f"链上多次检测到仍持有代币: {message}，继续监控")
+            # 重置检查标志，避免每次都检查
+            data["needs_balance_check"] = False
+
+            # 只在首次检测到时通知用户
+            if not data.get("balance_notified", False) and user_id:
+                try:
+                    await self.send_message(
+                        user_id,
+                        f"链上检测到仍持有代币 {ca}，将继续监控价格变化",
+                    )
+                    # 标记已通知，避免重复通知
+                    data["balance_notified"] = True
+                except Exception as e:
+                    logger.error(f"通知用户 {user_id} 失败: {e}")
+
+        return on_done
+
+    async def resend_transaction(
+        self, ca, tx_type, user_id, retry_count, max_retries, tx_id=None, tx=None
+    ):
+        """重试延迟结束后重新发送交易指令，Telegram未连接时排队等重连后补发"""
+        self.tracer.event_since(
+            ca, "retry_delay", "retry_delay", type=tx_type, retry_count=retry_count
+        )
+        if tx_type == "buy":
+            cmd = f"/buy {ca} {self.config['buy_amount']}"
+        else:  # sell
+            cmd = f"/sell {ca} 100"
+
+        try:
+            sent = await self.send_command(cmd, tx_id, tx)
+        except Exception as e:
+            logger.error(f"重新发送{tx_type}指令失败: {e}")
+            return
+        if sent:
+            self.tracer.mark(ca, f"{tx_type}_sent")
+            logger.info(f"已重新发送{tx_type}指令: {cmd}")
+
+        # 通知用户正在重试
+        if user_id:
+            self.notify_user(
+                user_id,
+                f"{tx_type.capitalize()}交易失败，正在进行第 {retry_count+1}/{max_retries} 次重试...",
+            )
 
     async def monitor_price(self):
         """定时检查价格是否达到目标涨幅或止损点"""
         while True:
+            started = time.perf_counter()
             try:
-                # 清理过期的待处理交易
-                self.cleanup_pending_transactions()
-
-                for ca, data in list(self.price_map.items()):
-                    buy_price = data["buy_price"]
-                    take_profit = data["take_profit"]
-                    stop_loss = data["stop_loss"]
-                    user_id = data.get("user_id")  # 获取用户ID
-
-                    # 如果配置了钱包地址，并且需要检查余额（交易后或首次检查）
-                    if self.config["wallet_address"] and (
-                        data.get("needs_balance_check", False)
-                        or not self.config.get(
-                            "check_balance_only_after_transaction", True
-                        )
-                    ):
-                        # 添加重试逻辑，最多重试3次
-                        has_balance = False
-                        max_retries = 3
-
-                        for retry in range(max_retries):
-                            has_balance, message = (
-                                await self.blockchain.check_token_balance(
-                                    self.config["wallet_address"], ca
-                                )
-                            )
+                await self.check_positions()
+            except Exception as e:
+                logger.error(f"监控价格时出错: {e}")
+            MONITOR_TICK.observe(time.perf_counter() - started)
+            self.save_state()
 
-                            if not has_balance:
-                                # 如果没有余额，表示已经成功卖出
-                                logger.info(
-                                    f"链上检测合约 {ca} 余额为零 (尝试 {retry+1}/{max_retries}): {message}"
-                                )
+            await asyncio.sleep(self.config["price_check_interval"])
 
-                                # 如果确认没有余额，从监控列表中移除
-                                user_id = self.price_map[ca].get("user_id")
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"链上检测到合约 {ca} 已卖出，停止监控价格变化",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
-
-                                # 从监控列表中移除
-                                del self.price_map[ca]
-                                break
-                            else:
-                                # 如果有余额，可能交易尚未确认，等待
-                                logger.warning(
-                                    f"链上检测到仍持有代币 (尝试 {retry+1}/{max_retries}): {message}"
-                                )
-                                if (
-                                    retry < max_retries - 1
-                                ):  # 如果不是最后一次尝试，则等待
-                                    await asyncio.sleep(5)  # 等待5秒再次检查
+    def make_sell_callback(self, ca, reason, sell_cmd):
+        """排队的卖出指令补发后完成卖出，被放弃时恢复触发止盈止损"""
+
+        def on_sent(sent):
+            self.queued_sells.discard(ca)
+            if not sent:
+                logger.warning(f"卖出指令未能发出，继续监控 {ca}")
+                return
+            # 以补发时的最新价格记录卖出
+            last = self.price_monitor.last_prices.get(ca)
+            self.complete_sell(ca, reason, sell_cmd, last["price"] if last else None)
+
+        return on_sent
+
+    def complete_sell(self, ca, reason, sell_cmd, price):
+        """卖出指令已发出：记录卖出、通知用户并停止监控该持仓"""
+        label = "止盈" if reason == "take_profit" else "止损"
+        self.tracer.mark(ca, "sell_sent")
+        logger.info(f"已发送卖出指令({label}): {sell_cmd}")
+        data = self.price_map.get(ca)
+        if data is None:
+            return
+        buy_price = data["buy_price"]
+        price = price or buy_price
+        gain = ((price - buy_price) / buy_price) * 100
+        user_id = data.get("user_id")
+
+        self.record_transaction(ca, "sell", price, "100%", user_id)
+
+        # 如果有用户ID，在后台通知用户
+        if user_id:
+            self.notify_user(
+                user_id,
+                f"""{label}触发! 已卖出 {ca}
+买入价格: ${buy_price:.8f}
+卖出价格: ${price:.8f}
+{"收益" if reason == "take_profit" else "损失"}: {gain:.2f}%""",
+            )
 
-                        # 如果经过多次检查后仍然持有代币
-                        if has_balance:
-                            logger.warning(
-                                f"链上多次检测到仍持有代币: {message}，继续监控"
-                            )
-                            # 重置检查标志，避免每次都检查
-                            self.price_map[ca]["needs_balance_check"] = False
-
-                            # 只在首次检测到时通知用户
-                            if not data.get("balance_notified", False):
-                                user_id = self.price_map[ca].get("user_id")
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"链上检测到仍持有代币 {ca}，将继续监控价格变化",
-                                        )
-                                        # 标记已通知，避免重复通知
-                                        self.price_map[ca]["balance_notified"] = True
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
-
-                    current_price = await PriceMonitor.get_price_dexscreener(ca)
-
-                    if current_price:
-                        gain = ((current_price - buy_price) / buy_price) * 100
-                        logger.info(f"合约 {ca} 当前涨幅: {gain:.2f}%")
-
-                        # 止盈
-                        if gain >= take_profit:
-                            try:
-                                # 确定发送目标
-                                target = (
-                                    self.config.get("bot_chat_id", "")
-                                    or self.config["bot_username"]
-                                )
+        del self.price_map[ca]
+
+    def evict_position(self, ca, reason, detail):
+        """停止监控一个持仓：归档到交易记录，清理相关状态并通知用户"""
+        data = self.price_map.pop(ca, None)
+        if data is None:
+            return
+        check = self.balance_checks.pop(ca, None)
+        if check is not None:
+            check.cancel()
+        self.entry_fills.pop(ca, None)
+        POSITIONS_EVICTED.inc(reason=reason)
+        logger.warning(f"持仓 {ca} 已停止监控: {detail}")
+        self.tracer.end_trace(ca, f"evicted_{reason}")
+
+        last = self.price_monitor.last_prices.get(ca)
+        last_price = last["price"] if last else None
+        if self.trades is not None:
+            self.trades.record(
+                ca, "evict", last_price, user_id=data.get("user_id"),
+                position_id=data.get("position_id"), ts=self.clock(), reason=reason,
+            )
 
-                                sell_cmd = f"/sell {ca} 100"  # 卖出全部
-
-                                # 记录待处理的卖出交易
-                                tx_id = f"sell_{ca}_{int(time.time())}"
-                                self.pending_transactions[tx_id] = {
-                                    "ca": ca,
-                                    "type": "sell",
-                                    "user_id": user_id,
-                                    "timestamp": time.time(),
-                                    "reason": "take_profit",
-                                    "retry_count": 0,  # 初始化重试计数
-                                    "max_retries": self.config[
-                                        "max_transaction_retries"
-                                    ],
-                                }
-
-                                await self.client.send_message(target, sell_cmd)
-                                logger.info(f"已发送卖出指令(止盈): {sell_cmd}")
-
-                                TransactionManager.save_transaction(
-                                    ca, "sell", current_price, "100%", user_id
-                                )
+        user_id = data.get("user_id")
+        if user_id:
+            self.notify_user(
+                user_id,
+                f"""已停止监控 {ca}
+原因: {detail}
+买入价格: ${data["buy_price"]:.8f}
+最新价格: {"未知" if last_price is None else f"${last_price:.8f}"}
+请手动处理该持仓""",
+            )
 
-                                # 如果有用户ID，通知用户
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"""止盈触发! 已卖出 {ca}
-买入价格: ${buy_price:.8f}
-卖出价格: ${current_price:.8f}
-收益: {gain:.2f}%""",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
+    def enforce_position_limits(self):
+        """淘汰超过最长监控时间的持仓；持仓数超出上限（如热重载调低了上限）时，
+        先淘汰连续取价失败次数最多、其次买入最早的持仓"""
+        now = self.clock()
+        max_age = self.config["max_position_age"]
+        if max_age:
+            for ca, data in list(self.price_map.items()):
+                if now - data.get("buy_time", now) > max_age:
+                    self.evict_position(
+                        ca, "expired", f"持仓超过最长监控时间 {max_age / 3600:.1f} 小时"
+                    )
 
-                                del self.price_map[ca]
-                            except Exception as e:
-                                logger.error(f"发送卖出指令失败: {e}")
+        max_positions = self.config["max_positions"]
+        overflow = len(self.price_map) - max_positions if max_positions else 0
+        if overflow > 0:
+            victims = sorted(
+                self.price_map.items(),
+                key=lambda item: (-item[1].get("price_failures", 0), item[1].get("buy_time", 0)),
+            )[:overflow]
+            for ca, _ in victims:
+                self.evict_position(ca, "over_budget", f"持仓数超过上限 {max_positions}")
+
+    async def check_positions(self):
+        """检查一轮所有持仓的价格"""
+        # 清理过期的待处理交易，淘汰过期和超出上限的持仓
+        self.cleanup_pending_transactions()
+        self.enforce_position_limits()
+
+        # 本轮取价失败的持仓
+        failed = []
+        for ca, data in list(self.price_map.items()):
+            buy_price = data["buy_price"]
+            take_profit = data["take_profit"]
+            stop_loss = data["stop_loss"]
+            user_id = data.get("user_id")  # 获取用户ID
+
+            # 如果配置了钱包地址，并且需要检查余额（交易后或首次检查）
+            if self.config["wallet_address"] and (
+                data.get("needs_balance_check", False)
+                or not self.config.get(
+                    "check_balance_only_after_transaction", True
+                )
+            ):
+                # 由时间轮在后台检查，不阻塞本轮价格检查
+                if ca not in self.balance_checks:
+                    self.confirm_balance(
+                        ca, False, self.make_monitor_balance_callback(ca)
+                    )
 
-                        # 止损
-                        elif gain <= -stop_loss:
-                            try:
-                                # 确定发送目标
-                                target = (
-                                    self.config.get("bot_chat_id", "")
-                                    or self.config["bot_username"]
-                                )
+            current_price = await self.get_price(ca)
 
-                                sell_cmd = f"/sell {ca} 100"  # 卖出全部
-
-                                # 记录待处理的卖出交易
-                                tx_id = f"sell_{ca}_{int(time.time())}"
-                                self.pending_transactions[tx_id] = {
-                                    "ca": ca,
-                                    "type": "sell",
-                                    "user_id": user_id,
-                                    "timestamp": time.time(),
-                                    "reason": "stop_loss",
-                                    "retry_count": 0,  # 初始化重试计数
-                                    "max_retries": self.config[
-                                        "max_transaction_retries"
-                                    ],
-                                }
-
-                                await self.client.send_message(target, sell_cmd)
-                                logger.info(f"已发送卖出指令(止损): {sell_cmd}")
-
-                                TransactionManager.save_transaction(
-                                    ca, "sell", current_price, "100%", user_id
-                                )
+            if current_price:
+                if data.get("price_failures") and ca in self.price_map:
+                    data["price_failures"] = 0
+                gain = ((current_price - buy_price) / buy_price) * 100
+                logger.info(
+                    f"合约 {ca} 当前涨幅: {gain:.2f}%",
+                    extra={"sample_key": f"gain:{ca}", "ca": ca, "gain": round(gain, 2)},
+                )
 
-                                # 如果有用户ID，通知用户
-                                if user_id:
-                                    try:
-                                        await self.client.send_message(
-                                            user_id,
-                                            f"""止损触发! 已卖出 {ca}
-买入价格: ${buy_price:.8f}
-卖出价格: ${current_price:.8f}
-损失: {gain:.2f}%""",
-                                        )
-                                    except Exception as e:
-                                        logger.error(f"通知用户 {user_id} 失败: {e}")
+                # 卖出指令排队中，等补发结果，不重复触发
+                if ca in self.queued_sells:
+                    continue
+
+                # 止盈
+                if gain >= take_profit:
+                    try:
+                        sell_cmd = f"/sell {ca} 100"  # 卖出全部
+
+                        # 待处理的卖出交易随指令登记，Telegram未连接时一起排队
+                        tx_id = f"sell_{ca}_{int(self.clock())}"
+                        tx = {
+                            "ca": ca,
+                            "type": "sell",
+                            "user_id": user_id,
+                            "timestamp": self.clock(),
+                            "reason": "take_profit",
+                            "retry_count": 0,  # 初始化重试计数
+                            "max_retries": self.config[
+                                "max_transaction_retries"
+                            ],
+                            "trace_id": data.get("trace_id"),
+                            "position_id": data.get("position_id"),
+                        }
 
-                                del self.price_map[ca]
-                            except Exception as e:
-                                logger.error(f"发送卖出指令失败: {e}")
-                    else:
-                        logger.warning(f"无法获取 {ca} 的当前价格")
-            except Exception as e:
-                logger.error(f"监控价格时出错: {e}")
+                        with self.tracer.span(
+                            data.get("trace_id"), "sell_send", reason="take_profit",
+                            price=current_price, gain=gain,
+                        ):
+                            sent = await self.send_command(
+                                sell_cmd, tx_id, tx, self.make_sell_callback(ca, "take_profit", sell_cmd)
+                            )
+                        if sent:
+                            self.complete_sell(ca, "take_profit", sell_cmd, current_price)
+                        else:
+                            # 发出前保留持仓继续监控，补发后再记录卖出
+                            self.queued_sells.add(ca)
+                            if user_id:
+                                self.notify_user(
+                                    user_id,
+                                    f"止盈触发，卖出指令已排队，Telegram恢复后发送: {ca}",
+                                )
+                    except Exception as e:
+                        logger.error(f"发送卖出指令失败: {e}")
+
+                # 止损
+                elif gain <= -stop_loss:
+                    try:
+                        sell_cmd = f"/sell {ca} 100"  # 卖出全部
+
+                        # 待处理的卖出交易随指令登记，Telegram未连接时一起排队
+                        tx_id = f"sell_{ca}_{int(self.clock())}"
+                        tx = {
+                            "ca": ca,
+                            "type": "sell",
+                            "user_id": user_id,
+                            "timestamp": self.clock(),
+                            "reason": "stop_loss",
+                            "retry_count": 0,  # 初始化重试计数
+                            "max_retries": self.config[
+                                "max_transaction_retries"
+                            ],
+                            "trace_id": data.get("trace_id"),
+                            "position_id": data.get("position_id"),
+                        }
 
-            await asyncio.sleep(self.config["price_check_interval"])
+                        with self.tracer.span(
+                            data.get("trace_id"), "sell_send", reason="stop_loss",
+                            price=current_price, gain=gain,
+                        ):
+                            sent = await self.send_command(
+                                sell_cmd, tx_id, tx, self.make_sell_callback(ca, "stop_loss", sell_cmd)
+                            )
+                        if sent:
+                            self.complete_sell(ca, "stop_loss", sell_cmd, current_price)
+                        else:
+                            # 发出前保留持仓继续监控，补发后再记录卖出
+                            self.queued_sells.add(ca)
+                            if user_id:
+                                self.notify_user(
+                                    user_id,
+                                    f"止损触发，卖出指令已排队，Telegram恢复后发送: {ca}",
+                                )
+                    except Exception as e:
+                        logger.error(f"发送卖出指令失败: {e}")
+            else:
+                logger.warning(
+                    f"无法获取 {ca} 的当前价格",
+                    extra={"sample_key": f"no_price:{ca}", "ca": ca},
+                )
+                failed.append(ca)
+
+        # 所有价格源都在熔断时是价格源故障，不计入各持仓的失败次数
+        max_failures = self.config["max_price_failures"]
+        if failed and self.price_monitor.available():
+            for ca in failed:
+                data = self.price_map.get(ca)
+                if data is None:
+                    continue
+                data["price_failures"] = data.get("price_failures", 0) + 1
+                if max_failures and data["price_failures"] >= max_failures:
+                    self.evict_position(
+                        ca, "price_unavailable", f"连续 {data['price_failures']} 轮无法获取价格"
+                    )
 
     async def start(self):
         """启动机器人"""
         retry_count = 0
         max_retries = 5
+        started = time.perf_counter()
+
+        LogManager.setup(
+            log_file=self.config["log_file"],
+            log_format=self.config["log_format"],
+            log_level=self.config["log_level"],
+            max_bytes=self.config["log_max_bytes"],
+            backup_count=self.config["log_backup_count"],
+            sample_interval=self.config["log_sample_interval"],
+        )
+
+        # 启动指标服务和事件循环延迟监控
+        self.register_metrics()
+        metrics_server = None
+        if self.config["metrics_port"]:
+            metrics_server = MetricsServer(
+                self.config["metrics_host"],
+                self.config["metrics_port"],
+                StatusApi(self) if self.config["status_api"] else None,
+            )
+            await metrics_server.start()
+        lag_task = asyncio.create_task(self.monitor_event_loop_lag())
+        config_task = None
+        if self.config_path and self.config["config_reload_interval"]:
+            self.config_mtime = os.stat(self.config_path).st_mtime_ns
+            config_task = asyncio.create_task(self.watch_config())
+
+        # 恢复缓存状态，预热API连接与Telegram登录并行进行
+        self.load_state()
+        if self.trades is not None:
+            try:
+                self.trades.import_legacy("transactions.json")
+            except Exception as e:
+                logger.error(f"导入旧交易记录失败: {e}")
+        warm_up_task = asyncio.create_task(self.warm_up(started))
+
+        # 在Telegram就绪前即开始监控恢复的持仓，卖出指令会等待连接就绪后发送
+        monitor_task = asyncio.create_task(self.monitor_price())
 
         while retry_count < max_retries:
             try:
+                login_started = time.perf_counter()
                 self.client = await self.connect_client()
+                STARTUP_SECONDS.set(time.perf_counter() - login_started, stage="telegram_login")
 
-                # 尝试获取交易机器人实体
-                try:
-                    bot_entity = await self.client.get_entity(
-                        self.config["bot_username"]
-                    )
-                    logger.info(f"已获取交易机器人实体: {bot_entity.id}")
-                    # 如果没有设置bot_chat_id，则使用获取到的实体ID
-                    if not self.config.get("bot_chat_id"):
-                        self.config["bot_chat_id"] = bot_entity.id
-                except Exception as e:
-                    logger.warning(f"获取交易机器人实体失败: {e}")
+                entity_started = time.perf_counter()
+                await self.resolve_bot_entity()
+                STARTUP_SECONDS.set(time.perf_counter() - entity_started, stage="bot_entity")
 
-                await self.setup_message_handler()
-                logger.info("自动交易机器人已启动")
+                await self.signals.resolve(self.client)
+                self.signal_chats = frozenset(self.signals.chats)
 
-                # 启动价格监控任务
-                monitor_task = asyncio.create_task(self.monitor_price())
+                await self.setup_message_handler()
+                self.ready.set()
+                resume_task = asyncio.create_task(self.resume_session())
+                time_to_ready = time.perf_counter() - started
+                STARTUP_SECONDS.set(time_to_ready, stage="ready")
+                logger.info(f"自动交易机器人已启动，就绪耗时 {time_to_ready:.2f}s")
 
                 # 运行客户端直到断开连接
                 await self.client.run_until_disconnected()
 
-                # 如果客户端断开连接，取消监控任务
-                monitor_task.cancel()
+                # 断开连接期间价格监控继续运行，卖出指令排队、通知等待重连
+                resume_task.cancel()
+                self.ready.clear()
+                self.client = None
+                started = time.perf_counter()
                 logger.warning("客户端断开连接，尝试重新连接...")
 
             except errors.NetworkError as e:
+                self.ready.clear()
+                self.client = None
                 retry_count += 1
                 wait_time = min(30, 2**retry_count)  # 指数退避策略
                 logger.error(
@@ -1080,6 +3988,40 @@ class BSCBot:
         if retry_count >= max_retries:
             logger.critical(f"达到最大重试次数 ({max_retries})，程序终止")
 
+        await self.shutdown(
+            monitor_task, warm_up_task, lag_task, *([config_task] if config_task else [])
+        )
+        if metrics_server:
+            await metrics_server.stop()
+
+    async def shutdown(self, *tasks):
+        """取消并等待后台任务和时间轮，保存状态后关闭交易记录库和HTTP会话
+
+        先等所有任务结束再关闭会话，避免仍在运行的任务在关闭后又创建新会话。
+        待发队列不保存：卖出未发出的持仓仍在状态文件中，重启后继续监控。
+        """
+        if self.outbox:
+            logger.warning(
+                f"退出时仍有 {len(self.outbox)} 条指令未发送，已丢弃: "
+                + "; ".join(text for text, *_ in self.outbox)
+            )
+        tasks = [*tasks, *self.buy_tasks, *self.notify_tasks, *self.background_tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.timers.close()
+        self.save_state()
+        if self.trades is not None:
+            self.trades.close()
+        await HttpClient.close()
+
+    async def warm_up(self, started):
+        """预热外部API的DNS解析和连接池"""
+        await HttpClient.warm_up(
+            [f"{self.config['dexscreener_api_url']}/", self.config["bscscan_api_url"]]
+        )
+        STARTUP_SECONDS.set(time.perf_counter() - started, stage="http_warm_up")
+
 
 async def main():
     """主函数"""
@@ -0,0 +1,656 @@
+"""端到端延迟基准测试
+
+使用本地模拟的 DexScreener / BSCScan 服务和模拟Telegram客户端运行真实的 BSCBot，
+测量以下指标：
+
+- buy:    收到合约地址 → 发出 /buy 的延迟
+- tick:   单轮价格检查耗时与持仓数量的关系
+- sell:   价格触及止盈/止损线 → 发出 /sell 的延迟
+- memory: 长时间买卖循环下的内存增长
+- signal: 信号频道突发消息的单条处理耗时，以及去重/限额结果
+- decode: DexScreener响应的解析耗时和内存分配（完整解析 vs 只提取所需字段）
+
+用法：
+    python benchmark.py
+    python benchmark.py --latency 0.05 --jitter 0.02 --error-rate 0.02 --rate-limit 20
+    python benchmark.py --output report.json --baseline baseline.json --tolerance 0.25
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from aiohttp import web
+
+from app import (
+    SIGNAL_ADDRESSES, BSCBot, ConfigManager, DexScreenerProvider, HttpClient, json_loads, logger,
+)
+from replay import BUY_CMD_RE, DEFAULT_REPLAY_CONFIG, SELL_CMD_RE, ReplayClient, latency_stats
+
+BENCH_USER = 10001
+BENCH_SIGNAL_CHAT = -1001000000001
+BENCH_WALLET = "0x000000000000000000000000000000000000bEEF"
+
+
+def random_address(rng):
+    return "0x" + "%040x" % rng.getrandbits(160)
+
+
+def dexscreener_pair(ca, price, chain_id="bsc", rng=None):
+    """生成与DexScreener返回格式一致的交易对数据"""
+    rng = rng or random
+    return {
+        "chainId": chain_id,
+        "dexId": "pancakeswap",
+        "url": f"https://dexscreener.com/{chain_id}/{ca.lower()}",
+        "pairAddress": random_address(rng),
+        "labels": ["v2"],
+        "baseToken": {"address": ca, "name": "Bench Token", "symbol": "BENCH"},
+        "quoteToken": {
+            "address": "0xbb4CdB9CBd36B01bD1cBaEBF2De08d9173bc095c",
+            "name": "Wrapped BNB",
+            "symbol": "WBNB",
+        },
+        "priceNative": f"{price / 600:.12f}",
+        "priceUsd": f"{price:.12f}",
+        "txns": {
+            window: {"buys": rng.randint(0, 5000), "sells": rng.randint(0, 5000)}
+            for window in ("m5", "h1", "h6", "h24")
+        },
+        "volume": {window: rng.uniform(0, 1e6) for window in ("m5", "h1", "h6", "h24")},
+        "priceChange": {window: rng.uniform(-50, 50) for window in ("m5", "h1", "h6", "h24")},
+        "liquidity": {"usd": rng.uniform(1e3, 1e6), "base": rng.uniform(1e6, 1e9), "quote": rng.uniform(1, 1e3)},
+        "fdv": rng.uniform(1e4, 1e8),
+        "marketCap": rng.uniform(1e4, 1e8),
+        "pairCreatedAt": int(time.time() * 1000) - rng.randint(0, 10**9),
+        "info": {
+            "imageUrl": "https://dd.dexscreener.com/ds-data/tokens/bsc/bench.png",
+            "websites": [{"label": "Website", "url": "https://example.com"}],
+            "socials": [{"type": "twitter", "url": "https://x.com/example"}],
+        },
+    }
+
+
+class MockAPIServer:
+    """本地模拟 DexScreener 和 BSCScan API
+
+    在独立线程的事件循环中运行，避免与被测机器人争用同一个循环。
+    支持配置响应延迟、错误率和限流（每秒请求数）。
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None,
+                 pairs_per_token=3, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.pairs_per_token = pairs_per_token
+        self.rng = random.Random(seed)
+        self.prices = {}
+        self.holdings = set()
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        self.base_url = None
+        self._tokens = float(rate_limit or 0)
+        self._last_refill = time.monotonic()
+        self._loop = None
+        self._thread = None
+
+    def _make_app(self):
+        app = web.Application()
+        app.router.add_get("/latest/dex/tokens/{ca}", self._dexscreener)
+        app.router.add_get("/api", self._bscscan)
+        return app
+
+    def start(self):
+        """启动服务，返回基础URL"""
+        ready = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            runner = web.AppRunner(self._make_app(), access_log=None)
+            self._loop.run_until_complete(runner.setup())
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            self._loop.run_until_complete(site.start())
+            port = site._server.sockets[0].getsockname()[1]
+            self.base_url = f"http://127.0.0.1:{port}"
+            ready.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mock-api", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _allow(self):
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.rate_limit, self._tokens + (now - self._last_refill) * self.rate_limit)
+        self._last_refill = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def _gate(self):
+        """模拟延迟、限流和错误，返回应直接返回的响应或None"""
+        self.stats["requests"] += 1
+        delay = self.latency + self.rng.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if not self._allow():
+            self.stats["rate_limited"] += 1
+            return "rate_limited"
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.Response(status=500, text="Internal Server Error")
+        return None
+
+    async def _dexscreener(self, request):
+        gate = await self._gate()
+        if gate == "rate_limited":
+            return web.Response(status=429, text="Too Many Requests")
+        if gate is not None:
+            return gate
+        ca = request.match_info["ca"]
+        price = self.prices.get(ca)
+        if price is None:
+            return web.json_response({"schemaVersion": "1.0.0", "pairs": None})
+        pairs = [dexscreener_pair(ca, price, rng=self.rng)]
+        for chain_id in ("ethereum", "base")[: max(0, self.pairs_per_token - 1)]:
+            pairs.append(dexscreener_pair(ca, price * self.rng.uniform(0.9, 1.1), chain_id, self.rng))
+        return web.json_response({"schemaVersion": "1.0.0", "pairs": pairs})
+
+    async def _bscscan(self, request):
+        gate = await self._gate()
+        if gate == "rate_limited":
+            return web.json_response({"status": "0", "message": "NOTOK", "result": "Max rate limit reached"})
+        if gate is not None:
+            return gate
+        q = request.query
+        module, action = q.get("module"), q.get("action")
+        if module == "contract" and action == "getabi":
+            if q.get("address") in self.prices:
+                return web.json_response(
+                    {"status": "0", "message": "NOTOK", "result": "Contract source code not verified"}
+                )
+            return web.json_response({"status": "0", "message": "NOTOK", "result": "Invalid Address format"})
+        if module == "account" and action == "tokenbalance":
+            balance = "1000000000000000000" if q.get("contractaddress") in self.holdings else "0"
+            return web.json_response({"status": "1", "message": "OK", "result": balance})
+        if module == "proxy":
+            return web.json_response({"jsonrpc": "2.0", "id": 1, "result": None})
+        return web.json_response({"status": "0", "message": "No transactions found", "result": []})
+
+
+class BenchClient(ReplayClient):
+    """模拟Telegram客户端，用真实时钟记录指令发出时刻"""
+
+    def __init__(self, bot, server, reply_delay=0.0):
+        super().__init__(bot, auto_reply_delay=reply_delay)
+        self.server = server
+        self.send_times = []
+        self._waiters = {}
+
+    def wait_command(self, kind, ca):
+        """返回一个在对应指令发出时完成的future"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[(kind, ca)] = future
+        return future
+
+    def _track_holdings(self, text):
+        match = re.search(r"0x[a-fA-F0-9]{40}", text)
+        if not match:
+            return
+        if "买入" in text:
+            self.server.holdings.add(match.group(0))
+        elif "卖出" in text:
+            self.server.holdings.discard(match.group(0))
+
+    async def send_message(self, entity, text):
+        started = time.perf_counter()
+        target = self._resolve(entity)
+        self.sent.append((started, target, text))
+        if target == self.bot_id:
+            for kind, regex in (("buy", BUY_CMD_RE), ("sell", SELL_CMD_RE)):
+                match = regex.match(text)
+                if match:
+                    future = self._waiters.pop((kind, match.group(1)), None)
+                    if future and not future.done():
+                        future.set_result(started)
+            reply = self._auto_reply(text)
+            if reply and self.auto_reply_delay is not None:
+                asyncio.get_running_loop().call_later(
+                    self.auto_reply_delay, self.deliver, self.bot_id, reply
+                )
+        self.send_times.append(time.perf_counter() - started)
+        return None
+
+
+def make_bot(server, args):
+    config = dict(DEFAULT_REPLAY_CONFIG)
+    config.update(
+        {
+            "dexscreener_api_url": server.base_url,
+            "bscscan_api_url": f"{server.base_url}/api",
+            "price_providers": ["dexscreener"],
+            "signal_sources": [
+                {"chat": BENCH_SIGNAL_CHAT, "notify_user": BENCH_USER, "max_per_minute": 30}
+            ],
+            "bscscan_api_key": "bench",
+            "wallet_address": BENCH_WALLET,
+            "authorized_users": [BENCH_USER],
+            "price_check_interval": args.interval,
+            "buy_confirmation_delay": 0,
+            "trace_file": "traces.jsonl",
+        }
+    )
+    bot = BSCBot(config=ConfigManager.apply_defaults(config))
+    bot.client = BenchClient(bot, server, reply_delay=args.reply_delay)
+    return bot
+
+
+async def bench_buy(bot, server, args, rng):
+    """收到合约地址 → 发出 /buy"""
+    samples = []
+    for _ in range(args.samples):
+        ca = random_address(rng)
+        server.prices[ca] = 1.0
+        waiter = bot.client.wait_command("buy", ca)
+        started = time.perf_counter()
+        bot.client.deliver(BENCH_USER, ca)
+        try:
+            sent_at = await asyncio.wait_for(waiter, args.timeout)
+            samples.append(sent_at - started)
+        except asyncio.TimeoutError:
+            print(f"等待 /buy {ca} 超时", file=sys.stderr)
+    return {"ca_to_buy": latency_stats(samples)}
+
+
+async def bench_tick(bot, server, args, rng):
+    """单轮价格检查耗时 vs 持仓数量"""
+    result = {}
+    for count in args.positions:
+        bot.price_map.clear()
+        for _ in range(count):
+            ca = random_address(rng)
+            server.prices[ca] = 1.0
+            bot.price_map[ca] = {
+                "buy_price": 1.0,
+                "buy_time": bot.clock(),
+                "take_profit": 10**9,
+                "stop_loss": 10**9,
+                "user_id": BENCH_USER,
+            }
+        durations = []
+        for _ in range(args.tick_rounds):
+            started = time.perf_counter()
+            await bot.check_positions()
+            durations.append(time.perf_counter() - started)
+        result[str(count)] = latency_stats(durations)
+    bot.price_map.clear()
+    return {"tick_duration": result}
+
+
+async def bench_sell(bot, server, args, rng):
+    """价格触及止盈线 → 发出 /sell"""
+    samples = []
+    monitor_task = asyncio.create_task(bot.monitor_price())
+    try:
+        for _ in range(args.samples):
+            ca = random_address(rng)
+            server.prices[ca] = 1.0
+            bot.price_map[ca] = {
+                "buy_price": 1.0,
+                "buy_time": bot.clock(),
+                "take_profit": 50,
+                "stop_loss": 90,
+                "user_id": BENCH_USER,
+            }
+            # 在检查间隔内随机时刻触发价格穿越
+            await asyncio.sleep(rng.uniform(0, args.interval))
+            waiter = bot.client.wait_command("sell", ca)
+            server.prices[ca] = 2.0
+            started = time.perf_counter()
+            try:
+                sent_at = await asyncio.wait_for(waiter, args.timeout + args.interval)
+                samples.append(sent_at - started)
+            except asyncio.TimeoutError:
+                print(f"等待 /sell {ca} 超时", file=sys.stderr)
+                bot.price_map.pop(ca, None)
+    finally:
+        monitor_task.cancel()
+        await asyncio.gather(monitor_task, return_exceptions=True)
+    return {"cross_to_sell": latency_stats(samples)}
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def bench_memory(bot, server, args, rng):
+    """完整买卖循环下的内存增长"""
+    tracemalloc.start()
+    monitor_task = asyncio.create_task(bot.monitor_price())
+    samples = []
+    started = time.perf_counter()
+    try:
+        for cycle in range(args.cycles):
+            ca = random_address(rng)
+            server.prices[ca] = 1.0
+            buy_waiter = bot.client.wait_command("buy", ca)
+            bot.client.deliver(BENCH_USER, ca)
+            await asyncio.wait_for(buy_waiter, args.timeout)
+            while ca not in bot.price_map:
+                await asyncio.sleep(0.001)
+            sell_waiter = bot.client.wait_command("sell", ca)
+            server.prices[ca] = 2.0
+            await asyncio.wait_for(sell_waiter, args.timeout + args.interval)
+            server.prices.pop(ca, None)
+            if cycle % max(1, args.cycles // 20) == 0:
+                current, _ = tracemalloc.get_traced_memory()
+                samples.append((cycle, current, _rss_bytes()))
+    except asyncio.TimeoutError:
+        print("内存测试中等待指令超时，提前结束", file=sys.stderr)
+    finally:
+        monitor_task.cancel()
+        await asyncio.gather(monitor_task, *bot.client.tasks, return_exceptions=True)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    growth_per_1k = None
+    if len(samples) >= 2 and samples[-1][0] > samples[0][0]:
+        (c0, m0, _), (c1, m1, _) = samples[0], samples[-1]
+        growth_per_1k = (m1 - m0) / (c1 - c0) * 1000
+    return {
+        "memory": {
+            "cycles": samples[-1][0] + 1 if samples else 0,
+            "duration": time.perf_counter() - started,
+            "traced_current": current,
+            "traced_peak": peak,
+            "rss": _rss_bytes(),
+            "growth_bytes_per_1k_cycles": growth_per_1k,
+            "price_map": len(bot.price_map),
+            "pending_transactions": len(bot.pending_transactions),
+            "samples": samples,
+        }
+    }
+
+
+async def bench_signal(bot, server, args, rng):
+    """信号频道突发消息：每条消息混有多个地址、链接和交易哈希"""
+    pool = [random_address(rng) for _ in range(args.signal_pool)]
+    for ca in pool:
+        server.prices[ca] = 1.0
+    before = dict(SIGNAL_ADDRESSES.values)
+    first = len(bot.client.handler_times)
+    for _ in range(args.signal_messages):
+        a, b, c = rng.sample(pool, 3)
+        tx_hash = "0x%064x" % rng.getrandbits(256)
+        bot.client.deliver(
+            BENCH_SIGNAL_CHAT,
+            f"🚀 New call\nCA: {a}\nChart: https://dexscreener.com/bsc/{b.lower()}\n"
+            f"Buy tx {tx_hash}\nAlso watching {c} 🔥",
+            is_private=False,
+        )
+    while bot.client.tasks:
+        await asyncio.gather(*list(bot.client.tasks), return_exceptions=True)
+    await asyncio.gather(*list(bot.buy_tasks), return_exceptions=True)
+
+    outcomes = {}
+    for (source, outcome), value in SIGNAL_ADDRESSES.values.items():
+        if source == str(BENCH_SIGNAL_CHAT):
+            outcomes[outcome] = value - before.get((source, outcome), 0)
+    return {
+        "signal": {
+            "messages": args.signal_messages,
+            "handle": latency_stats(bot.client.handler_times[first:]),
+            "outcomes": outcomes,
+        }
+    }
+
+
+def _decode_full(body):
+    """原先的做法：完整解析后取第一个交易对的价格"""
+    data = json.loads(body)
+    return float(data["pairs"][0]["priceUsd"]) if data.get("pairs") else None
+
+
+async def bench_decode(bot, server, args, rng):
+    """解析带完整元数据的DexScreener响应，比较每条响应的耗时和内存分配"""
+    bodies = []
+    for _ in range(args.decode_responses):
+        ca = random_address(rng)
+        pairs = [
+            dexscreener_pair(ca, rng.uniform(0.0001, 1), rng.choice(("bsc", "ethereum", "base")), rng)
+            for _ in range(args.decode_pairs)
+        ]
+        bodies.append(json.dumps({"schemaVersion": "1.0.0", "pairs": pairs}).encode())
+
+    results = {
+        "pairs_per_response": args.decode_pairs,
+        "body_bytes": sum(map(len, bodies)) // len(bodies),
+    }
+    for name, decode, parser in (
+        ("full", _decode_full, "json"),
+        ("lean", DexScreenerProvider.decode_pairs, getattr(json_loads, "__module__", "json")),
+    ):
+        times = []
+        for body in bodies:
+            started = time.perf_counter()
+            decode(body)
+            times.append(time.perf_counter() - started)
+        # 内存分配单独统计，避免 tracemalloc 影响耗时
+        sample = bodies[: min(len(bodies), 200)]
+        peaks, retained = [], []
+        tracemalloc.start()
+        for body in sample:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            result = decode(body)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - base)
+            retained.append(current - base)
+            del result
+        tracemalloc.stop()
+        results[name] = {
+            "parser": parser,
+            "time": latency_stats(times),
+            "peak_bytes": sum(peaks) // len(peaks),
+            "retained_bytes": sum(retained) // len(retained),
+        }
+    return {"decode": results}
+
+
+SCENARIOS = {
+    "buy": bench_buy,
+    "tick": bench_tick,
+    "sell": bench_sell,
+    "memory": bench_memory,
+    "signal": bench_signal,
+    "decode": bench_decode,
+}
+
+
+async def run_benchmarks(args):
+    server = MockAPIServer(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    )
+    server.start()
+    rng = random.Random(args.seed)
+    report = {"params": {k: v for k, v in vars(args).items() if k not in ("baseline", "output")}}
+    try:
+        for name in args.scenarios:
+            bot = make_bot(server, args)
+            await bot.setup_message_handler()
+            started = time.perf_counter()
+            report.update(await SCENARIOS[name](bot, server, args, rng))
+            print(f"场景 {name} 完成，耗时 {time.perf_counter() - started:.2f}s", file=sys.stderr)
+            await asyncio.gather(*bot.client.tasks, return_exceptions=True)
+            await bot.shutdown()
+        report["server"] = dict(server.stats)
+    finally:
+        await HttpClient.close()
+        server.stop()
+    return report
+
+
+def _metric_paths(report):
+    """提取用于回归比较的指标（越小越好）"""
+    paths = {}
+    for key in ("ca_to_buy", "cross_to_sell"):
+        if report.get(key, {}).get("count"):
+            paths[f"{key}.p95"] = report[key]["p95"]
+    for count, stats in report.get("tick_duration", {}).items():
+        if stats.get("count"):
+            paths[f"tick_duration.{count}.p95"] = stats["p95"]
+    growth = report.get("memory", {}).get("growth_bytes_per_1k_cycles")
+    if growth is not None:
+        paths["memory.growth_bytes_per_1k_cycles"] = max(growth, 0)
+    handle = report.get("signal", {}).get("handle", {})
+    if handle.get("count"):
+        paths["signal.handle.p95"] = handle["p95"]
+    lean = report.get("decode", {}).get("lean")
+    if lean and lean["time"].get("count"):
+        paths["decode.lean.time.p95"] = lean["time"]["p95"]
+    return paths
+
+
+def compare(report, baseline, tolerance):
+    """与基线报告比较，返回回归列表"""
+    regressions = []
+    current = _metric_paths(report)
+    for path, base in _metric_paths(baseline).items():
+        value = current.get(path)
+        if value is None or base <= 0:
+            continue
+        if value > base * (1 + tolerance):
+            regressions.append((path, base, value))
+    return regressions
+
+
+def print_report(report):
+    for key in ("ca_to_buy", "cross_to_sell"):
+        stats = report.get(key)
+        if stats and stats.get("count"):
+            print(
+                f"{key}: n={stats['count']} p50={stats['p50'] * 1000:.1f}ms "
+                f"p95={stats['p95'] * 1000:.1f}ms max={stats['max'] * 1000:.1f}ms"
+            )
+    for count, stats in report.get("tick_duration", {}).items():
+        print(f"tick_duration[{count} 持仓]: p50={stats['p50'] * 1000:.1f}ms p95={stats['p95'] * 1000:.1f}ms")
+    memory = report.get("memory")
+    if memory:
+        growth = memory["growth_bytes_per_1k_cycles"]
+        print(
+            f"memory: {memory['cycles']} 次循环, 峰值 {memory['traced_peak'] / 1024:.0f}KB, "
+            f"RSS {memory['rss'] / 1024 / 1024:.1f}MB, "
+            f"增长 {'N/A' if growth is None else f'{growth / 1024:.1f}KB/千次'}"
+        )
+    signal = report.get("signal")
+    if signal and signal["handle"].get("count"):
+        print(
+            f"signal: {signal['messages']} 条消息, 单条处理 p50={signal['handle']['p50'] * 1e6:.0f}us "
+            f"p95={signal['handle']['p95'] * 1e6:.0f}us, 地址 {signal['outcomes']}"
+        )
+    decode = report.get("decode")
+    if decode:
+        for name in ("full", "lean"):
+            stats = decode[name]
+            print(
+                f"decode[{name}]: {decode['pairs_per_response']} 个交易对/{decode['body_bytes'] / 1024:.0f}KB "
+                f"({stats['parser']}), p50={stats['time']['p50'] * 1e6:.0f}us "
+                f"p95={stats['time']['p95'] * 1e6:.0f}us, 峰值分配 {stats['peak_bytes'] / 1024:.0f}KB, "
+                f"保留 {stats['retained_bytes']}B"
+            )
+    if "server" in report:
+        print(f"server: {report['server']}")
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GMGN 端到端延迟基准测试")
+    parser.add_argument("--scenarios", type=lambda v: v.split(","), default=list(SCENARIOS),
+                        help=f"要运行的场景，逗号分隔 ({','.join(SCENARIOS)})")
+    parser.add_argument("--latency", type=float, default=0.02, help="模拟API基础延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.01, help="模拟API延迟抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟API错误率")
+    parser.add_argument("--rate-limit", type=float, default=None, help="模拟API限流（每秒请求数）")
+    parser.add_argument("--reply-delay", type=float, default=0.5, help="模拟交易机器人回复延迟（秒）")
+    parser.add_argument("--interval", type=float, default=1.0, help="价格检查间隔（秒）")
+    parser.add_argument("--samples", type=int, default=20, help="buy/sell 场景的样本数")
+    parser.add_argument("--positions", type=_int_list, default=[1, 10, 50, 100], help="tick 场景的持仓数量")
+    parser.add_argument("--tick-rounds", type=int, default=5, help="tick 场景每档的轮数")
+    parser.add_argument("--cycles", type=int, default=200, help="memory 场景的买卖循环次数")
+    parser.add_argument("--signal-messages", type=int, default=500, help="signal 场景的消息数")
+    parser.add_argument("--signal-pool", type=int, default=200, help="signal 场景的地址池大小")
+    parser.add_argument("--decode-responses", type=int, default=2000, help="decode 场景的响应数")
+    parser.add_argument("--decode-pairs", type=int, default=30, help="decode 场景每条响应的交易对数")
+    parser.add_argument("--timeout", type=float, default=30.0, help="等待单个指令的超时（秒）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--output", help="报告输出文件 (JSON)")
+    parser.add_argument("--baseline", help="基线报告，用于检测性能回归")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的回归比例")
+    parser.add_argument("--verbose", action="store_true", help="输出机器人日志")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    if not args.verbose:
+        logger.setLevel(logging.ERROR)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # 在临时目录运行，避免写入真实的交易记录
+    os.chdir(tempfile.mkdtemp(prefix="gmgn_bench_"))
+    report = asyncio.run(run_benchmarks(args))
+    print_report(report)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline:
+        regressions = compare(report, baseline, args.tolerance)
+        for path, base, value in regressions:
+            print(f"性能回归: {path} 基线 {base:.6f} → 当前 {value:.6f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
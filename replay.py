@@ -0,0 +1,568 @@
+"""确定性回放/回测引擎
+
+把录制的价格行情和交易机器人回复，按虚拟时钟喂给 BSCBot 的真实决策逻辑
+（消息处理器与 monitor_price），不依赖 Telegram 和任何外部 API。
+
+录制文件为 JSON Lines，每行一个事件，按时间戳 t 排序：
+
+    {"t": 1700000000.0, "type": "price", "ca": "0x...", "price": 0.0012}
+    {"t": 1700000001.5, "type": "ca", "user_id": 123456789, "ca": "0x..."}
+    {"t": 1700000009.0, "type": "reply", "text": "已成功买入 0x..."}
+
+用法：
+    python replay.py recording.jsonl
+    python replay.py recording.jsonl --target-gain 20,50 --stop-loss 5,10 \\
+        --interval 1,5,30 --workers 4 --output results.json
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import logging
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from app import BSCBot, ConfigManager, logger
+
+BUY_CMD_RE = re.compile(r"^/buy\s+(0x[a-fA-F0-9]{40})")
+SELL_CMD_RE = re.compile(r"^/sell\s+(0x[a-fA-F0-9]{40})")
+
+# 回放默认配置，录制文件里没有Telegram和钱包信息
+DEFAULT_REPLAY_CONFIG = {
+    "api_id": 0,
+    "api_hash": "",
+    "bot_username": "replay_trading_bot",
+    "bot_chat_id": 1000,
+    "wallet_address": "",
+    "buy_amount": "0.01",
+    "target_gain_percent": 50,
+    "stop_loss_percent": 10,
+    "price_check_interval": 30,
+    "buy_confirmation_delay": 3,
+    "authorized_users": [],
+    "trace_file": "",
+    "state_file": "",
+    "trade_db": "",
+}
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """虚拟时钟事件循环
+
+    没有就绪回调时，不真正等待，而是把时钟直接拨到下一个定时器，
+    因此 asyncio.sleep 不消耗真实时间，回放可以远快于实时。
+    """
+
+    def __init__(self, start=0.0):
+        super().__init__()
+        self._virtual_time = float(start)
+        # 录制时间戳是Unix时间，纳秒级分辨率会被浮点精度吞掉
+        self._clock_resolution = 1e-6
+        select = self._selector.select
+
+        def _select(timeout=None):
+            # 直接对齐到最早定时器的时刻，避免大时间戳下浮点累加丢失精度
+            if timeout and self._scheduled:
+                self._virtual_time = max(self._virtual_time, self._scheduled[0].when())
+            return select(0)
+
+        self._selector.select = _select
+
+    def time(self):
+        return self._virtual_time
+
+
+class Tape:
+    """录制数据"""
+
+    def __init__(self, events):
+        self.events = sorted(events, key=lambda ev: ev["t"])
+        self.prices = {}
+        for ev in self.events:
+            if ev["type"] == "price":
+                series = self.prices.setdefault(ev["ca"], ([], []))
+                series[0].append(ev["t"])
+                series[1].append(float(ev["price"]))
+        self.start = self.events[0]["t"] if self.events else 0.0
+        self.end = self.events[-1]["t"] if self.events else 0.0
+
+    @classmethod
+    def load(cls, path):
+        """从JSON Lines文件加载"""
+        events = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    events.append(json.loads(line))
+        return cls(events)
+
+    def price_at(self, ca, t):
+        """返回t时刻（含）之前最后一个价格"""
+        series = self.prices.get(ca)
+        if not series:
+            return None
+        idx = bisect.bisect_right(series[0], t) - 1
+        if idx < 0:
+            return None
+        return series[1][idx]
+
+    def first_cross(self, ca, since, buy_price, take_profit, stop_loss):
+        """返回since之后价格首次触及止盈/止损线的时刻"""
+        series = self.prices.get(ca)
+        if not series or not buy_price:
+            return None
+        idx = bisect.bisect_left(series[0], since)
+        for t, price in zip(series[0][idx:], series[1][idx:]):
+            gain = ((price - buy_price) / buy_price) * 100
+            if gain >= take_profit or gain <= -stop_loss:
+                return t
+        return None
+
+
+class ReplayMessage:
+    """模拟Telethon消息对象"""
+
+    def __init__(self, message_id, text):
+        self.id = message_id
+        self.message = text
+        self.entities = None
+
+
+class ReplayEvent:
+    """模拟Telethon NewMessage事件"""
+
+    def __init__(self, message_id, sender_id, text, is_private=True):
+        self.sender_id = sender_id
+        self.chat_id = sender_id
+        self.is_private = is_private
+        self.message = ReplayMessage(message_id, text)
+        self.raw_text = text
+
+
+class ReplayChain:
+    """模拟链上余额查询"""
+
+    def __init__(self):
+        self.holdings = set()
+
+    async def check_token_balance(self, wallet_address, token_address):
+        if token_address in self.holdings:
+            return True, "余额: 1"
+        return False, "余额为零"
+
+    async def get_contract_address_from_transaction(self, tx_hash):
+        return None
+
+
+class ReplayValidator:
+    """模拟合约验证，录制中有行情的合约视为有效"""
+
+    def __init__(self, tape, latency):
+        self.tape = tape
+        self.latency = latency
+
+    async def verify_contract(self, ca):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if ca in self.tape.prices:
+            return True, "合约地址有效"
+        return False, "找不到该合约地址的交易对，可能是新合约或未上线"
+
+
+class ReplayClient:
+    """模拟Telegram客户端
+
+    记录所有发出的消息；可选地对 /buy、/sell 指令自动回复成功消息。
+    与Telethon一致，每条消息在独立任务中按注册顺序依次调用匹配的处理器。
+    """
+
+    def __init__(self, bot, auto_reply_delay=None):
+        self.bot = bot
+        self.bot_id = bot.config["bot_chat_id"]
+        self.bot_username = bot.config["bot_username"]
+        self.auto_reply_delay = auto_reply_delay
+        self.handlers = []
+        self.sent = []
+        self.handler_times = []
+        self.tasks = set()
+        self._message_id = 0
+
+    def on(self, builder):
+        def decorator(callback):
+            self.handlers.append((builder, callback))
+            return callback
+
+        return decorator
+
+    def _resolve(self, entity):
+        if entity in (self.bot_username, self.bot_id):
+            return self.bot_id
+        return entity
+
+    def _matches(self, builder, event):
+        if isinstance(builder, type):
+            return True
+        from_users = getattr(builder, "from_users", None)
+        if from_users is not None:
+            users = from_users if isinstance(from_users, (list, tuple, set)) else [from_users]
+            if event.sender_id not in {self._resolve(u) for u in users}:
+                return False
+        chats = getattr(builder, "chats", None)
+        if chats is not None:
+            chats = chats if isinstance(chats, (list, tuple, set)) else [chats]
+            if event.chat_id not in {self._resolve(c) for c in chats}:
+                return False
+        func = getattr(builder, "func", None)
+        if func is not None and not func(event):
+            return False
+        return True
+
+    def deliver(self, sender_id, text, is_private=True):
+        """投递一条新消息"""
+        self._message_id += 1
+        event = ReplayEvent(self._message_id, sender_id, text, is_private)
+        if sender_id == self.bot_id:
+            self._track_holdings(text)
+        task = asyncio.get_running_loop().create_task(self._dispatch(event))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _dispatch(self, event):
+        for builder, callback in self.handlers:
+            if self._matches(builder, event):
+                started = time.perf_counter()
+                await callback(event)
+                self.handler_times.append(time.perf_counter() - started)
+
+    def _track_holdings(self, text):
+        match = re.search(r"0x[a-fA-F0-9]{40}", text)
+        if not match:
+            return
+        if "买入" in text or "bought" in text.lower():
+            self.bot.blockchain.holdings.add(match.group(0))
+        elif "卖出" in text or "sold" in text.lower():
+            self.bot.blockchain.holdings.discard(match.group(0))
+
+    async def send_message(self, entity, text):
+        now = self.bot.clock()
+        target = self._resolve(entity)
+        self.sent.append((now, target, text))
+        if target == self.bot_id:
+            self.bot.on_command_sent(now, text)
+            if self.auto_reply_delay is not None:
+                reply = self._auto_reply(text)
+                if reply:
+                    asyncio.get_running_loop().call_later(
+                        self.auto_reply_delay, self.deliver, self.bot_id, reply
+                    )
+        self._message_id += 1
+        return ReplayMessage(self._message_id, text)
+
+    @staticmethod
+    def _auto_reply(cmd):
+        match = BUY_CMD_RE.match(cmd)
+        if match:
+            return f"已成功买入 {match.group(1)}"
+        match = SELL_CMD_RE.match(cmd)
+        if match:
+            return f"已成功卖出 {match.group(1)}"
+        return None
+
+
+class ReplayBot(BSCBot):
+    """接入回放数据的BSCBot，决策逻辑完全复用父类"""
+
+    def __init__(self, config, tape, price_latency=0.0, price_failure_rate=0.0,
+                 verify_latency=0.0, auto_reply_delay=None, seed=0):
+        super().__init__(config=config)
+        self.tape = tape
+        self.price_latency = price_latency
+        self.price_failure_rate = price_failure_rate
+        self.random = random.Random(seed)
+        self.blockchain = ReplayChain()
+        self.validator = ReplayValidator(tape, verify_latency)
+        self.client = ReplayClient(self, auto_reply_delay)
+        self.clock = asyncio.get_running_loop().time
+        self.positions = []
+        self.open_positions = {}
+        self.ca_received = {}
+        self._last_command = {}
+
+    async def get_price(self, ca):
+        if self.price_latency:
+            await asyncio.sleep(self.price_latency)
+        if self.price_failure_rate and self.random.random() < self.price_failure_rate:
+            return None
+        return self.tape.price_at(ca, self.clock())
+
+    def record_transaction(self, ca, action, price, amount=None, user_id=None):
+        now = self.clock()
+        if action == "buy":
+            position = {
+                "ca": ca,
+                "user_id": user_id,
+                "received_at": self.ca_received.get(ca),
+                "buy_sent_at": self._last_command.get(("buy", ca)),
+                "buy_time": now,
+                "buy_price": price,
+                "sell_sent_at": None,
+                "sell_price": None,
+                "exit_reason": "open",
+            }
+            self.open_positions[ca] = position
+            self.positions.append(position)
+        elif action == "sell" and ca in self.open_positions:
+            position = self.open_positions.pop(ca)
+            position["sell_sent_at"] = self._last_command.get(("sell", ca))
+            position["sell_price"] = price
+            for tx in self.pending_transactions.values():
+                if tx["ca"] == ca and tx["type"] == "sell":
+                    position["exit_reason"] = tx.get("reason", "sell")
+
+    def on_command_sent(self, now, cmd):
+        """记录指令发出时刻"""
+        match = BUY_CMD_RE.match(cmd)
+        if match:
+            self._last_command[("buy", match.group(1))] = now
+            return
+        match = SELL_CMD_RE.match(cmd)
+        if match:
+            self._last_command[("sell", match.group(1))] = now
+
+
+class ReplayEngine:
+    """回放引擎，一次run即一次完整回测"""
+
+    def __init__(self, tape, config=None, settle_time=None, **options):
+        self.tape = tape
+        self.base_config = dict(DEFAULT_REPLAY_CONFIG)
+        if config:
+            self.base_config.update(config)
+        self.settle_time = settle_time
+        self.options = options
+
+    def run(self, overrides=None):
+        """按给定参数回放一次，返回结果字典"""
+        config = dict(self.base_config)
+        config.update(overrides or {})
+        config = ConfigManager.apply_defaults(config)
+        if not config["authorized_users"]:
+            config["authorized_users"] = sorted(
+                {ev["user_id"] for ev in self.tape.events if ev["type"] == "ca"}
+            )
+
+        loop = VirtualClockLoop(start=self.tape.start)
+        started = time.perf_counter()
+        try:
+            bot = loop.run_until_complete(self._run(config))
+        finally:
+            loop.close()
+        wall_time = time.perf_counter() - started
+        return self._summarize(bot, config, overrides or {}, wall_time)
+
+    async def _run(self, config):
+        bot = ReplayBot(config, self.tape, **self.options)
+        await bot.setup_message_handler()
+        monitor_task = asyncio.create_task(bot.monitor_price())
+
+        loop = asyncio.get_running_loop()
+        for ev in self.tape.events:
+            delay = ev["t"] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if ev["type"] == "ca":
+                bot.ca_received.setdefault(ev["ca"], loop.time())
+                bot.client.deliver(ev["user_id"], ev["ca"])
+            elif ev["type"] == "reply":
+                bot.client.deliver(bot.client.bot_id, ev["text"])
+
+        # 录制结束后再运行一段时间，让进行中的流程完成
+        settle_time = self.settle_time
+        if settle_time is None:
+            settle_time = 2 * config["price_check_interval"] + config["buy_confirmation_delay"] + 10
+        await asyncio.sleep(settle_time)
+
+        await bot.shutdown(monitor_task, *bot.client.tasks)
+        return bot
+
+    def _summarize(self, bot, config, overrides, wall_time):
+        tape = self.tape
+        positions = []
+        ca_to_buy = []
+        cross_to_sell = []
+        for p in bot.positions:
+            exit_price = p["sell_price"]
+            if exit_price is None:
+                exit_price = tape.price_at(p["ca"], tape.end)
+            gain = None
+            if p["buy_price"] and exit_price is not None:
+                gain = ((exit_price - p["buy_price"]) / p["buy_price"]) * 100
+            if p["received_at"] is not None and p["buy_sent_at"] is not None:
+                ca_to_buy.append(p["buy_sent_at"] - p["received_at"])
+            if p["sell_sent_at"] is not None:
+                crossed = tape.first_cross(
+                    p["ca"], p["buy_time"], p["buy_price"],
+                    config["target_gain_percent"], config["stop_loss_percent"],
+                )
+                if crossed is not None:
+                    cross_to_sell.append(p["sell_sent_at"] - crossed)
+            positions.append(
+                {
+                    "ca": p["ca"],
+                    "user_id": p["user_id"],
+                    "buy_time": p["buy_time"],
+                    "buy_price": p["buy_price"],
+                    "exit_price": exit_price,
+                    "exit_reason": p["exit_reason"],
+                    "gain_percent": gain,
+                    "hold_seconds": (p["sell_sent_at"] or tape.end) - p["buy_time"],
+                }
+            )
+
+        gains = [p["gain_percent"] for p in positions if p["gain_percent"] is not None]
+        closed = [p for p in positions if p["exit_reason"] != "open"]
+        virtual_time = max(tape.end - tape.start, 0.0)
+        return {
+            "params": overrides,
+            "positions": positions,
+            "summary": {
+                "positions": len(positions),
+                "closed": len(closed),
+                "take_profit": sum(1 for p in closed if p["exit_reason"] == "take_profit"),
+                "stop_loss": sum(1 for p in closed if p["exit_reason"] == "stop_loss"),
+                "win_rate": (sum(1 for g in gains if g > 0) / len(gains)) if gains else None,
+                "total_gain_percent": sum(gains),
+                "mean_gain_percent": (sum(gains) / len(gains)) if gains else None,
+                "commands_sent": sum(1 for _, target, _ in bot.client.sent if target == bot.client.bot_id),
+            },
+            "latency": {
+                "ca_to_buy": latency_stats(ca_to_buy),
+                "cross_to_sell": latency_stats(cross_to_sell),
+                "handler_wall": latency_stats(bot.client.handler_times),
+            },
+            "wall_time": wall_time,
+            "speedup": (virtual_time / wall_time) if wall_time > 0 else None,
+        }
+
+
+def latency_stats(samples):
+    """计算延迟分位数（秒）"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": ordered[-1],
+    }
+
+
+def _run_one(args):
+    tape_path, config, options, overrides = args
+    logger.setLevel(logging.WARNING)
+    engine = ReplayEngine(Tape.load(tape_path), config=config, **options)
+    result = engine.run(overrides)
+    # 参数扫描时只保留汇总，避免进程间传输大量持仓明细
+    result.pop("positions")
+    return result
+
+
+def sweep(tape_path, grid, config=None, workers=1, **options):
+    """对参数网格逐一回放，grid形如 {"target_gain_percent": [20, 50], ...}"""
+    keys = sorted(grid)
+    jobs = [
+        (tape_path, config, options, dict(zip(keys, values)))
+        for values in itertools.product(*(grid[k] for k in keys))
+    ]
+    if workers <= 1:
+        return [_run_one(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_one, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+
+def _number_list(value):
+    return [float(v) if "." in v else int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GMGN 交易逻辑确定性回放")
+    parser.add_argument("tape", help="录制文件 (JSON Lines)")
+    parser.add_argument("--config", help="基础配置文件，默认使用回放内置配置")
+    parser.add_argument("--target-gain", type=_number_list, help="止盈百分比，逗号分隔")
+    parser.add_argument("--stop-loss", type=_number_list, help="止损百分比，逗号分隔")
+    parser.add_argument("--interval", type=_number_list, help="价格检查间隔（秒），逗号分隔")
+    parser.add_argument("--price-latency", type=float, default=0.0, help="模拟价格接口延迟（秒）")
+    parser.add_argument("--price-failure-rate", type=float, default=0.0, help="模拟价格接口失败率")
+    parser.add_argument("--verify-latency", type=float, default=0.0, help="模拟合约验证延迟（秒）")
+    parser.add_argument("--auto-reply", type=float, default=None,
+                        help="对/buy、/sell自动回复成功消息的延迟（秒），不设置则只使用录制的回复")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--workers", type=int, default=1, help="并行进程数")
+    parser.add_argument("--output", help="结果输出文件 (JSON)")
+    parser.add_argument("--verbose", action="store_true", help="输出机器人日志")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+
+    config = None
+    if args.config:
+        with open(args.config, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+
+    options = {
+        "price_latency": args.price_latency,
+        "price_failure_rate": args.price_failure_rate,
+        "verify_latency": args.verify_latency,
+        "auto_reply_delay": args.auto_reply,
+        "seed": args.seed,
+    }
+    grid = {}
+    if args.target_gain:
+        grid["target_gain_percent"] = args.target_gain
+    if args.stop_loss:
+        grid["stop_loss_percent"] = args.stop_loss
+    if args.interval:
+        grid["price_check_interval"] = args.interval
+
+    if grid:
+        results = sweep(args.tape, grid, config=config, workers=args.workers, **options)
+        for r in results:
+            s = r["summary"]
+            print(
+                f"{r['params']}: 持仓 {s['positions']}, 止盈 {s['take_profit']}, "
+                f"止损 {s['stop_loss']}, 总收益 {s['total_gain_percent']:.2f}%, "
+                f"耗时 {r['wall_time']:.3f}s"
+            )
+    else:
+        results = ReplayEngine(Tape.load(args.tape), config=config, **options).run()
+        for p in results["positions"]:
+            gain = p["gain_percent"]
+            print(
+                f"{p['ca']} 用户 {p['user_id']} 买入 {p['buy_price']} "
+                f"{p['exit_reason']} 收益 {'N/A' if gain is None else f'{gain:.2f}%'}"
+            )
+        print(json.dumps(results["latency"], ensure_ascii=False, indent=2))
+        print(f"回放耗时 {results['wall_time']:.3f}s，加速比 {results['speedup']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
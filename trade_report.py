@@ -0,0 +1,85 @@
+"""交易记录统计与导出
+
+读取机器人写入的 trades.db（SQLite），按用户、合约或日期统计已实现盈亏，
+或导出为列式文件供 pandas / polars / DuckDB 分析。
+
+用法：
+    python trade_report.py pnl --by token --since 7d
+    python trade_report.py pnl --by day --since 2026-10-01 --json
+    python trade_report.py export trades.parquet
+    python trade_report.py import transactions.json
+"""
+
+import argparse
+import json
+import logging
+import time
+from datetime import datetime
+
+from app import TradeStore, logger
+
+
+def _since(value):
+    """"7d" / "12h" 表示相对当前时间，也可以是日期 "2026-10-01" """
+    units = {"d": 86400, "h": 3600, "m": 60}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法解析时间: {value}")
+
+
+def print_pnl(rows, by):
+    print(f"{by:<44} {'卖出':>6} {'盈利':>6} {'平均收益%':>10} {'盈亏BNB':>12}")
+    for row in rows:
+        pnl = row["pnl_bnb"]
+        print(
+            f"{str(row['key']):<44} {row['sells']:>6} {row['wins']:>6} "
+            f"{row['avg_gain_percent']:>10.2f} {'N/A' if pnl is None else f'{pnl:.6f}':>12}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GMGN 交易记录统计与导出")
+    parser.add_argument("--db", default="trades.db", help="交易记录库路径")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pnl = commands.add_parser("pnl", help="统计已实现盈亏")
+    pnl.add_argument("--by", choices=sorted(TradeStore.GROUPS), default="token", help="分组方式")
+    pnl.add_argument("--since", type=_since, help="起始时间，如 7d、12h 或 2026-10-01")
+    pnl.add_argument("--until", type=_since, help="截止时间")
+    pnl.add_argument("--json", action="store_true", help="以JSON输出")
+
+    export = commands.add_parser("export", help="导出列式文件（.parquet / .arrow / .npz）")
+    export.add_argument("path", help="输出文件")
+    export.add_argument("--since", type=_since, help="起始时间")
+
+    legacy = commands.add_parser("import", help="导入旧的 transactions.json")
+    legacy.add_argument("path", nargs="?", default="transactions.json", help="旧交易记录文件")
+    args = parser.parse_args()
+
+    logger.setLevel(logging.WARNING)
+    store = TradeStore(args.db)
+    try:
+        if args.command == "pnl":
+            started = time.perf_counter()
+            rows = store.pnl(args.by, args.since, args.until)
+            if args.json:
+                print(json.dumps(rows, ensure_ascii=False, indent=2))
+            else:
+                print_pnl(rows, args.by)
+                print(f"共 {len(rows)} 组，耗时 {time.perf_counter() - started:.3f}s")
+        elif args.command == "export":
+            try:
+                print(f"已导出 {store.export(args.path, args.since)} 条交易记录到 {args.path}")
+            except (RuntimeError, ValueError) as e:
+                parser.exit(1, f"导出失败: {e}\n")
+        else:
+            print(f"已导入 {store.import_legacy(args.path)} 条交易记录")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()